@@ -2,8 +2,11 @@ import os, time, base64, datetime, requests
 import streamlit as st
 from dotenv import load_dotenv
 
-from codexr.utils_auth import signup_user, login_user, load_history, save_history as persist_history, clear_history
+from codexr.utils_auth import signup_user, login_user, load_history, clear_history
 from codexr.llm import generate_structured_answer
+from codexr.refine import refine_answer_section, section_options
+from codexr.conversation import build_context, new_session_id
+from codexr.profiling import should_profile
 from codexr.schema import Answer
 
 load_dotenv()
@@ -12,6 +15,8 @@ st.set_page_config(page_title="CodeXR", layout="wide", page_icon="assets/logo.pn
 ss = st.session_state
 ss.setdefault("user", None)
 ss.setdefault("last", None)
+ss.setdefault("last_ts", None)
+ss.setdefault("session_id", new_session_id())
 ss.setdefault("verbosity", "normal")
 ss.setdefault("live_mode", False)
 ss.setdefault("theme", "dark")
@@ -215,14 +220,21 @@ with left:
         if q.strip():
             with st.spinner("Generating... ⚡"):
                 try:
-                    ans_dict = generate_structured_answer(q, verbosity=ss["verbosity"], live_mode=ss["live_mode"])
+                    convo = build_context(user["email"], ss["session_id"])
+                    ts = int(time.time())
+                    # History is saved by the pipeline after the answer is returned.
+                    ans_dict = generate_structured_answer(q, verbosity=ss["verbosity"], live_mode=ss["live_mode"], conversation=convo,
+                                                          user_email=user["email"], session_id=ss["session_id"], timestamp=ts,
+                                                          profile=should_profile(st.context.headers))
                     ans = Answer(**ans_dict)
-                    ss["last"] = ans; ss["query"]=q
-                    persist_history(user["email"], {"query":q,"answer":ans.model_dump()})
+                    ss["last"] = ans; ss["query"]=q; ss["last_ts"] = ts
+                    ss["pending_entry"] = {"query": q, "answer": ans_dict, "timestamp": ts, "session_id": ss["session_id"]}
                 except Exception as e:
                     st.error(f"Error: {e}")
         else:
             st.warning("Enter a question first.")
+    if st.button("🆕 New conversation"):
+        ss["session_id"] = new_session_id(); ss["last"] = None; ss["last_ts"] = None; ss["query"] = ""; st.rerun()
     st.markdown("</div>", unsafe_allow_html=True)
 
 with right:
@@ -247,12 +259,31 @@ with right:
         if res.docs:
             st.markdown("#### 📚 Docs"); [st.markdown(f"- [{d.title}]({d.url})") for d in res.docs]
         with st.expander("Raw JSON"): st.json(res.model_dump())
+        with st.expander("🔧 Refine a section"):
+            opts = section_options(res.model_dump())
+            r_label = st.selectbox("Section", list(opts), key="refine_section")
+            r_instr = st.text_input("What should change?", key="refine_instruction",
+                                    placeholder="e.g. add error handling to the snippet")
+            if st.button("♻️ Refine"):
+                with st.spinner("Refining... ⚡"):
+                    try:
+                        new = Answer(**refine_answer_section(res.model_dump(), opts[r_label], r_instr,
+                                                             query=ss.get("query",""), verbosity=ss["verbosity"],
+                                                             user_email=user["email"], timestamp=ss.get("last_ts")))
+                        ss["last"] = new
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error: {e}")
     else: st.info("Ask CodeXR something to see results.")
     st.markdown("</div>", unsafe_allow_html=True)
 
 # ----------------- Sidebar -----------------
 st.sidebar.markdown(f"**Signed in as:** {user['name']} ({user['email']})")
 hist_raw = load_history(user["email"]) or []
+# The background save may not have landed yet on the run that generated the answer.
+pending = ss.pop("pending_entry", None)
+if pending and not any(h.get("timestamp") == pending["timestamp"] and h.get("query") == pending["query"] for h in hist_raw):
+    hist_raw.insert(0, pending)
 if hist_raw:
     st.sidebar.subheader("📂 Chronicle Archive")
     if st.sidebar.button("🗑️ Clear All History"):
@@ -263,7 +294,7 @@ if hist_raw:
             ts=time.strftime("%Y-%m-%d %H:%M",time.localtime(h.get("timestamp",0)))
             disp=h.get("query","")[:40]+"..." if len(h.get("query",""))>40 else h.get("query","")
             if st.sidebar.button(disp, key=f"h{idx}"):
-                ss["query"]=h["query"]; ss["last"]=h["answer"]; st.rerun()
+                ss["query"]=h["query"]; ss["last"]=h["answer"]; ss["last_ts"]=h.get("timestamp"); ss["session_id"]=h.get("session_id") or new_session_id(); st.rerun()
             st.sidebar.caption(f"({ts})")
         except: pass
 else:
@@ -1,3 +1,9 @@
 from .schema import Answer, Subtask, Snippet, DocRef
-from .pipelines import run_pipeline
 __all__ = ["Answer", "Subtask", "Snippet", "DocRef", "run_pipeline"]
+
+def __getattr__(name):
+    # Imported lazily so `python -m codexr.<module>` doesn't pull in the whole pipeline first.
+    if name == "run_pipeline":
+        from .pipelines import run_pipeline
+        return run_pipeline
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,133 @@
+"""Token-bounded conversation context for follow-up questions.
+
+Turns belong to a session (``session_id`` on history entries). The most recent
+turns go into the prompt verbatim; older ones are folded into a rolling
+summary that is cached per session and only extended with newly aged-out
+turns, so each request does O(new turns) work and the context never exceeds
+CONTEXT_TOKENS regardless of conversation length.
+"""
+import os, re, json, uuid
+from typing import Any, Dict, List, Optional
+
+from codexr.tokens import estimate_tokens, trim_to_tokens
+from codexr.utils_auth import DATA_DIR, _safe_email, load_history
+
+SESSIONS_DIR = os.path.join(DATA_DIR, "sessions")
+
+CONTEXT_TOKENS = 1500       # hard cap for everything this module adds to a prompt
+SUMMARY_TOKENS = 400        # share of the cap reserved for the rolling summary
+RECENT_TURNS = 3            # turns kept verbatim (budget permitting)
+TURN_TOKENS = 500           # cap for any single verbatim turn
+
+# Canned replies from the topic gate; they carry no context and must not make a session look on-topic.
+_NOTICE_TITLES = {"Greeting", "Farewell", "Not Supported"}
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+# Words that tie a query to the previous turn ("now make it work for Quest 3").
+_FOLLOW_UP_WORDS = frozenset(
+    "it its this that these those them now also instead same again above previous earlier more another too then".split()
+)
+
+def is_follow_up(query: str) -> bool:
+    return any(w in _FOLLOW_UP_WORDS for w in re.findall(r"[a-z]+", (query or "").lower()))
+
+def last_query(context: str) -> str:
+    """The user's most recent query in a build_context() section ("" if there is none)."""
+    for line in reversed((context or "").splitlines()):
+        if line.startswith("User: "):
+            return line[len("User: "):]
+        if line.startswith("- Asked: "):
+            return line[len("- Asked: "):].split(" -> covered:")[0]
+    return ""
+
+def is_notice(turn: Dict[str, Any]) -> bool:
+    subtasks = (turn.get("answer") or {}).get("subtasks") or []
+    return len(subtasks) == 1 and subtasks[0].get("title") in _NOTICE_TITLES
+
+def session_turns(history: List[Dict[str, Any]], session_id: str) -> List[Dict[str, Any]]:
+    """Answered entries of `session_id` in chronological order (history is stored newest-first)."""
+    return [h for h in reversed(history) if h.get("session_id") == session_id and not is_notice(h)]
+
+def render_turn(turn: Dict[str, Any]) -> str:
+    """A turn as prompt text: the query and the answer's prose/code, capped at TURN_TOKENS."""
+    ans = turn.get("answer") or {}
+    lines = [f"User: {turn.get('query', '')}", "CodeXR:"]
+    for s in ans.get("subtasks") or []:
+        lines.append(f"- {s.get('title', '')}: {s.get('details', '')}")
+        lines.extend(f"  * {step}" for step in s.get("steps") or [])
+    snip = ans.get("snippet")
+    if snip and snip.get("code"):
+        lines.append(f"[{snip.get('filename', '')} ({snip.get('language', '')})]\n{snip['code']}")
+    return trim_to_tokens("\n".join(lines), TURN_TOKENS)
+
+def compress_turn(turn: Dict[str, Any]) -> str:
+    """One-line extractive summary of a turn for the rolling summary."""
+    ans = turn.get("answer") or {}
+    titles = ", ".join(s.get("title", "") for s in ans.get("subtasks") or [])
+    line = f"- Asked: {turn.get('query', '').strip()} -> covered: {titles or 'n/a'}"
+    snip = ans.get("snippet")
+    if snip and snip.get("filename"):
+        line += f"; code: {snip['filename']}"
+    return trim_to_tokens(line, 80)
+
+def _summary_path(email: str, session_id: str) -> str:
+    return os.path.join(SESSIONS_DIR, _safe_email(email), f"{session_id}.json")
+
+def _load_summary(path: str) -> Dict[str, Any]:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def rolling_summary(email: str, session_id: str, older: List[Dict[str, Any]]) -> str:
+    """Summary of `older` turns, extending the cached one instead of recomputing it."""
+    if not older:
+        return ""
+    path = _summary_path(email, session_id)
+    cache = _load_summary(path)
+    covered = cache.get("covered", 0)
+    # Reuse only if the cache still describes a prefix of this session (history may have been cleared).
+    if not (0 < covered <= len(older) and cache.get("last_ts") == older[covered - 1].get("timestamp")):
+        covered, lines = 0, []
+    else:
+        lines = cache.get("lines", [])
+    if covered == len(older):
+        return "\n".join(lines)
+
+    lines = lines + [compress_turn(t) for t in older[covered:]]
+    # Rolling: drop the oldest lines until the summary fits its share of the budget.
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > SUMMARY_TOKENS:
+        lines.pop(0)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"covered": len(older), "last_ts": older[-1].get("timestamp"), "lines": lines}, f)
+    return "\n".join(lines)
+
+def build_context(email: str, session_id: Optional[str], history: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Prompt section carrying the prior turns of `session_id`, at most CONTEXT_TOKENS long."""
+    if not session_id:
+        return ""
+    turns = session_turns(history if history is not None else load_history(email), session_id)
+    if not turns:
+        return ""
+
+    budget = CONTEXT_TOKENS
+    recent: List[str] = []
+    for t in reversed(turns[-RECENT_TURNS:]):
+        text = render_turn(t)
+        if estimate_tokens(text) > budget - SUMMARY_TOKENS:
+            break
+        recent.insert(0, text)
+        budget -= estimate_tokens(text)
+    older = turns[:len(turns) - len(recent)]
+
+    parts = []
+    summary = trim_to_tokens(rolling_summary(email, session_id, older), min(SUMMARY_TOKENS, budget))
+    if summary:
+        parts.append("Earlier in this conversation:\n" + summary)
+    if recent:
+        parts.append("Most recent turns:\n" + "\n\n".join(recent))
+    return "\n\n".join(parts)
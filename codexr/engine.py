@@ -0,0 +1,155 @@
+"""Minimal staged pipeline engine.
+
+A pipeline is a list of `Stage`s, each declaring the values it reads
+(`inputs`) and writes (`outputs`). Every stage starts as soon as its inputs
+exist, so independent stages overlap. The run returns as soon as the result
+value is produced (a stage may produce it early, e.g. a greeting), cancelling
+whatever is still in flight. A value declared by several stages comes from
+the first one that returns it non-None. A stage with a `fallback` is optional:
+if it raises, the error is logged and the fallback outputs are used, so e.g.
+grounding can never fail a request; any other stage's error fails the run. `deferred` stages run on a background thread
+after that, off the response's critical path; they also see `timings` and
+`elapsed_ms`, and get None for inputs the short-circuited run never produced.
+"""
+import copy, time, asyncio, inspect, logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from dataclasses import dataclass, field, replace as _dc_replace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from codexr.profiling import in_profiled_thread
+
+log = logging.getLogger(__name__)
+
+_BACKGROUND = ThreadPoolExecutor(max_workers=2, thread_name_prefix="codexr-deferred")
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    fn: Callable[..., Any]            # called with its inputs as kwargs; returns a dict of outputs (or None)
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+    threaded: bool = False            # run a blocking sync fn in a worker thread
+    deferred: bool = False            # run after the result has been returned (missing inputs -> None)
+    fallback: Optional[Dict[str, Any]] = None   # optional stage: on error, log it and output these instead
+
+@dataclass
+class RunResult:
+    values: Dict[str, Any]
+    timings: Dict[str, float] = field(default_factory=dict)    # stage name -> ms
+    deferred: List[Future] = field(default_factory=list)
+
+class Engine:
+    def __init__(self, stages: Iterable[Stage], result: str = "answer"):
+        self.stages: List[Stage] = list(stages)
+        self.result = result
+        names = [s.name for s in self.stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate stage names in {names}")
+
+    # ---- plugging ----
+    def replace(self, name: str, **changes) -> "Engine":
+        """Copy of this engine with stage `name` changed (e.g. replace("search", fn=my_search))."""
+        if name not in {s.name for s in self.stages}:
+            raise KeyError(name)
+        return Engine([_dc_replace(s, **changes) if s.name == name else s for s in self.stages], self.result)
+
+    def add(self, stage: Stage) -> "Engine":
+        return Engine(self.stages + [stage], self.result)
+
+    def without(self, name: str) -> "Engine":
+        return Engine([s for s in self.stages if s.name != name], self.result)
+
+    # ---- running ----
+    async def _call(self, stage: Stage, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        if inspect.iscoroutinefunction(stage.fn):
+            out = await stage.fn(**kwargs)
+        elif stage.threaded:
+            out = await asyncio.to_thread(in_profiled_thread(stage.fn), **kwargs)
+        else:
+            out = stage.fn(**kwargs)
+        return out or {}
+
+    async def run(self, **initial) -> RunResult:
+        live = [s for s in self.stages if not s.deferred]
+        produced = set(initial) | {k for s in live for k in s.outputs}
+        for s in live:
+            missing = [k for k in s.inputs if k not in produced]
+            if missing:
+                raise ValueError(f"Stage {s.name!r} needs {missing}, which no stage produces")
+
+        values: Dict[str, Any] = dict(initial)
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
+        events = {k: asyncio.Event() for s in live for k in s.outputs}
+        producers = {k: sum(k in s.outputs for s in live) for k in events}
+        finished = asyncio.Event()
+
+        async def run_stage(s: Stage):
+            for k in s.inputs:
+                if k not in values:
+                    await events[k].wait()
+            if finished.is_set():
+                return
+            t0 = time.perf_counter()
+            try:
+                out = await self._call(s, {k: values[k] for k in s.inputs})
+            except Exception:
+                if s.fallback is None:
+                    raise
+                log.warning("Optional stage %r failed; using its fallback", s.name, exc_info=True)
+                out = copy.deepcopy(s.fallback)
+            finally:
+                timings[s.name] = round((time.perf_counter() - t0) * 1000, 2)
+            for k in s.outputs:
+                v = out.get(k)
+                if k == self.result:
+                    # The result is first-writer-wins and only counts once actually produced.
+                    if v is not None and not finished.is_set():
+                        values[k] = v
+                        finished.set()
+                else:
+                    # A value several stages can produce is taken from the first one that
+                    # actually produces it (None only once every producer has finished).
+                    producers[k] -= 1
+                    if v is not None or producers[k] == 0:
+                        values.setdefault(k, v)
+                        events[k].set()
+
+        tasks = [asyncio.create_task(run_stage(s), name=f"stage:{s.name}") for s in live]
+        waiter = asyncio.create_task(finished.wait())
+        everything = asyncio.gather(*tasks)
+        try:
+            await asyncio.wait({waiter, everything}, return_when=asyncio.FIRST_COMPLETED)
+            if not finished.is_set():
+                await everything          # re-raises the stage error, if any
+                raise RuntimeError(f"Pipeline finished without producing {self.result!r}")
+        finally:
+            waiter.cancel()
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(everything, waiter, return_exceptions=True)
+
+        result = RunResult(values, timings)
+        snapshot = dict(values, timings=dict(timings), elapsed_ms=round((time.perf_counter() - started) * 1000, 2))
+        for s in self.stages:
+            if s.deferred:
+                fut = _BACKGROUND.submit(_run_deferred, s, snapshot, timings)
+                fut.add_done_callback(partial(_log_failure, s.name))
+                result.deferred.append(fut)
+        return result
+
+def _log_failure(name: str, fut: Future):
+    # Nobody awaits deferred stages, so their errors would otherwise vanish with the future.
+    if not fut.cancelled() and fut.exception() is not None:
+        log.error("Deferred stage %r failed", name, exc_info=fut.exception())
+
+def _run_deferred(stage: Stage, values: Dict[str, Any], timings: Dict[str, float]):
+    t0 = time.perf_counter()
+    try:
+        kwargs = {k: values.get(k) for k in stage.inputs}
+        if inspect.iscoroutinefunction(stage.fn):
+            return asyncio.run(stage.fn(**kwargs))
+        return stage.fn(**kwargs)
+    finally:
+        timings[stage.name] = round((time.perf_counter() - t0) * 1000, 2)
@@ -0,0 +1,183 @@
+"""Bounded page fetching + text extraction for Live Mode grounding.
+
+Search gives us titles and URLs; this pulls the pages themselves under hard
+caps (connections, per-host concurrency, bytes, per-page time and an overall
+latency budget) and keeps a small URL-keyed cache that revalidates with ETags.
+Only public hosts are fetched, and redirects are followed hop by hop so each
+target is checked too; loopback/private/link-local addresses never reach the prompt.
+"""
+import time, codecs, asyncio, ipaddress
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+
+from codexr.textutil import HTMLText
+from codexr.tokens import estimate_tokens, trim_to_tokens
+
+MAX_CONNECTIONS = 8
+PER_HOST_LIMIT = 2
+MAX_PAGE_BYTES = 512 * 1024
+PAGE_TIMEOUT = 2.5          # seconds per page, connect + read; never more than the budget
+FETCH_BUDGET = 3.0          # seconds for the whole fetch stage
+MAX_REDIRECTS = 3
+MAX_PAGE_CHARS = 6000       # extraction stops once this much text is collected
+CACHE_TTL = 15 * 60
+CACHE_SIZE = 256
+
+USER_AGENT = "CodeXR/1.0 (+https://github.com/manit25/CodeXR)"
+
+# ----------------- Cache -----------------
+class _CacheEntry:
+    __slots__ = ("text", "etag", "last_modified", "fetched_at")
+
+    def __init__(self, text: str, etag: Optional[str], last_modified: Optional[str]):
+        self.text, self.etag, self.last_modified = text, etag, last_modified
+        self.fetched_at = time.time()
+
+_CACHE: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+
+def _cache_put(url: str, entry: _CacheEntry):
+    _CACHE[url] = entry
+    _CACHE.move_to_end(url)
+    while len(_CACHE) > CACHE_SIZE:
+        _CACHE.popitem(last=False)
+
+def clear_cache():
+    _CACHE.clear()
+
+# ----------------- Fetching -----------------
+async def is_public_url(url: str) -> bool:
+    """True if every address `url`'s host resolves to is globally routable."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return False
+    try:
+        addrs = [ipaddress.ip_address(parts.hostname)]
+    except ValueError:
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, parts.port or None)
+        except OSError:
+            return False
+        addrs = [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+    return bool(addrs) and all(a.is_global for a in addrs)
+
+async def _fetch_one(client: httpx.AsyncClient, url: str, host_limits: Dict[str, asyncio.Semaphore],
+                     max_bytes: int, max_chars: int, allow_private: bool = False) -> str:
+    cached = _CACHE.get(url)
+    if cached and time.time() - cached.fetched_at < CACHE_TTL:
+        return cached.text
+
+    headers = {"User-Agent": USER_AGENT, "Accept": "text/html,text/plain;q=0.9"}
+    if cached and cached.etag:
+        headers["If-None-Match"] = cached.etag
+    if cached and cached.last_modified:
+        headers["If-Modified-Since"] = cached.last_modified
+
+    target = url
+    for _ in range(MAX_REDIRECTS + 1):
+        if not allow_private and not await is_public_url(target):
+            return ""
+        sem = host_limits.setdefault(urlsplit(target).netloc, asyncio.Semaphore(PER_HOST_LIMIT))
+        async with sem:
+            async with client.stream("GET", target, headers=headers, follow_redirects=False) as r:
+                if r.is_redirect and "location" in r.headers:
+                    target = urljoin(target, r.headers["location"])
+                    continue
+                text = await _read_page(r, url, cached, max_bytes, max_chars)
+        if text is not None:
+            _cache_put(url, _CacheEntry(text, r.headers.get("etag"), r.headers.get("last-modified")))
+            return text
+        return cached.text
+    return ""
+
+async def _read_page(r: httpx.Response, url: str, cached: Optional[_CacheEntry],
+                     max_bytes: int, max_chars: int) -> Optional[str]:
+    """Extracted text of a final (non-redirect) response; None means "still fresh, use the cache"."""
+    if r.status_code == 304 and cached:
+        cached.fetched_at = time.time()
+        if url in _CACHE:
+            _CACHE.move_to_end(url)
+        return None
+    ctype = r.headers.get("content-type", "")
+    if r.status_code != 200 or not ctype.startswith(("text/html", "text/plain", "application/xhtml")):
+        return ""
+
+    try:
+        decoder = codecs.getincrementaldecoder(r.charset_encoding or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parser = HTMLText(max_chars, compact=True)
+    plain = ctype.startswith("text/plain")
+    received = 0
+    async for chunk in r.aiter_bytes():
+        chunk = chunk[:max_bytes - received]
+        received += len(chunk)
+        data = decoder.decode(chunk)
+        if plain:
+            parser.add_text(data)
+        else:
+            parser.feed(data)
+        if parser.done or received >= max_bytes:
+            break
+    return parser.text()
+
+async def fetch_pages(
+    urls: List[str],
+    budget: float = FETCH_BUDGET,
+    page_timeout: float = PAGE_TIMEOUT,
+    max_bytes: int = MAX_PAGE_BYTES,
+    max_chars: int = MAX_PAGE_CHARS,
+    client: Optional[httpx.AsyncClient] = None,
+    allow_private: bool = False,
+) -> Dict[str, str]:
+    """Fetch `urls` concurrently and return {url: extracted text} for pages done within `budget`.
+
+    Pages that error, time out, aren't text, or live on non-public hosts are
+    simply absent from the result. `allow_private` is for local testing only.
+    """
+    page_timeout = min(page_timeout, budget)
+    urls = list(dict.fromkeys(u for u in urls if u and u.startswith(("http://", "https://"))))
+    if not urls:
+        return {}
+
+    own_client = client is None
+    if own_client:
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(page_timeout),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        )
+    host_limits: Dict[str, asyncio.Semaphore] = {}
+    tasks = {
+        asyncio.ensure_future(asyncio.wait_for(_fetch_one(client, u, host_limits, max_bytes, max_chars, allow_private), page_timeout)): u
+        for u in urls
+    }
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=budget)
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        out = {}
+        for t in done:
+            if not t.cancelled() and t.exception() is None and t.result():
+                out[tasks[t]] = t.result()
+        return out
+    finally:
+        if own_client:
+            await client.aclose()
+
+def trim_extracts(results: List[Dict[str, str]], max_tokens: int) -> List[Dict[str, str]]:
+    """Fit each result's `text` into a shared token budget, preserving search order.
+
+    Budget is split evenly; whatever a short page doesn't use rolls over to the next.
+    """
+    with_text = [r for r in results if r.get("text")]
+    out, remaining = [], max_tokens
+    for i, r in enumerate(with_text):
+        share = remaining // (len(with_text) - i)
+        text = trim_to_tokens(r["text"], share)
+        remaining -= estimate_tokens(text)
+        out.append({**r, "text": text})
+    return out
@@ -0,0 +1,239 @@
+"""Streaming history export/import as NDJSON (optionally gzip-compressed).
+
+Each line is ``{"user": <user hash>, "entry": {...}}``. Export reads the
+per-user history files incrementally, so memory stays flat regardless of
+file size. Import merges newest-first by timestamp into the existing file
+through a temp file + atomic replace and skips entries already present
+(by content hash), so re-running an import is a no-op. It holds the same
+per-user file lock as the app's history writes, so it is safe to run
+against a live app.
+
+    python -m codexr.history_io export -o backup.ndjson.gz
+    python -m codexr.history_io export --email me@example.com -o me.ndjson
+    python -m codexr.history_io import backup.ndjson.gz
+"""
+import os, io, sys, gzip, json, heapq, hashlib, logging, argparse, itertools, tempfile
+from typing import IO, Any, Dict, Iterator, Optional, Tuple, Union
+
+from codexr import utils_auth
+from codexr.utils_auth import _safe_email, _json_default, history_lock
+
+log = logging.getLogger(__name__)
+
+_CHUNK = 64 * 1024
+_GZIP_MAGIC = b"\x1f\x8b"
+
+def _history_path(user: str) -> str:
+    return os.path.join(utils_auth.HISTORY_DIR, f"{user}.json")
+
+def entry_hash(entry: Dict[str, Any]) -> str:
+    """Content hash used for import dedup (key order and whitespace don't matter)."""
+    raw = json.dumps(entry, sort_keys=True, separators=(",", ":"), default=_json_default)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def iter_history_file(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the entries of a JSON-array history file one at a time, without loading it whole."""
+    if not os.path.exists(path):
+        return
+    dec = json.JSONDecoder()
+    with open(path, "r") as f:
+        buf, eof, started = "", False, False
+        while True:
+            buf = buf.lstrip()
+            if not buf and not eof:
+                chunk = f.read(_CHUNK)
+                eof = not chunk
+                buf += chunk
+                continue
+            if not buf:
+                return
+            if not started:
+                if buf[0] != "[":
+                    return  # not a history array (corrupt file); load_history treats it as empty too
+                buf, started = buf[1:], True
+                continue
+            if buf[0] == "]":
+                return
+            if buf[0] == ",":
+                buf = buf[1:]
+                continue
+            try:
+                obj, end = dec.raw_decode(buf)
+            except json.JSONDecodeError:
+                if eof:
+                    return
+                chunk = f.read(_CHUNK)
+                eof = not chunk
+                buf += chunk
+                continue
+            buf = buf[end:]
+            if isinstance(obj, dict):
+                yield obj
+
+# ----------------- File helpers -----------------
+def _open_out(dest: Union[str, IO[bytes]]) -> Tuple[IO[str], bool]:
+    if not isinstance(dest, str):
+        return io.TextIOWrapper(dest, encoding="utf-8", write_through=True), False
+    if dest == "-":
+        return sys.stdout, False
+    if dest.endswith(".gz"):
+        return gzip.open(dest, "wt", encoding="utf-8"), True
+    return open(dest, "w", encoding="utf-8"), True
+
+def _open_in(src: Union[str, IO[bytes]]) -> Tuple[IO[str], bool]:
+    if src == "-":
+        return sys.stdin, False
+    if isinstance(src, str):
+        with open(src, "rb") as f:
+            gz = f.read(2) == _GZIP_MAGIC
+        return (gzip.open(src, "rt", encoding="utf-8") if gz else open(src, "r", encoding="utf-8")), True
+    peek = src.peek(2)[:2] if hasattr(src, "peek") else b""
+    if peek == _GZIP_MAGIC:
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=src), encoding="utf-8"), False
+    return io.TextIOWrapper(src, encoding="utf-8"), False
+
+# ----------------- Export -----------------
+def export_history(dest: Union[str, IO[bytes]], email: Optional[str] = None) -> int:
+    """Write one user's (or, with no email, every user's) history as NDJSON. Returns entries written.
+
+    `dest` is a path ('.gz' compresses, '-' is stdout) or a binary file object.
+    """
+    if email:
+        users = [_safe_email(email)]
+    elif os.path.isdir(utils_auth.HISTORY_DIR):
+        users = sorted(n[:-len(".json")] for n in os.listdir(utils_auth.HISTORY_DIR) if n.endswith(".json"))
+    else:
+        users = []
+
+    out, owned = _open_out(dest)
+    n = 0
+    try:
+        for user in users:
+            for entry in iter_history_file(_history_path(user)):
+                out.write(json.dumps({"user": user, "entry": entry}, default=_json_default) + "\n")
+                n += 1
+    finally:
+        if owned:
+            out.close()
+        else:
+            out.flush()
+            if isinstance(out, io.TextIOWrapper) and out is not sys.stdout:
+                out.detach()
+    return n
+
+# ----------------- Import -----------------
+def _write_array(path: str, entries: Iterator[Dict[str, Any]]):
+    with open(path, "w") as f:
+        f.write("[")
+        for i, e in enumerate(entries):
+            f.write(("," if i else "") + "\n" + json.dumps(e, indent=2, default=_json_default))
+        f.write("\n]")
+
+def _newest_first(entry: Dict[str, Any]):
+    return -(entry.get("timestamp") or 0)
+
+def _merge_user(user: str, incoming: Iterator[Dict[str, Any]]) -> int:
+    """Merge `incoming` entries into a user's history file; returns how many were new.
+
+    Call under history_lock(user). Only the existing entries' hashes are held
+    in memory, not the entries, and the file is only rewritten if something is new.
+    """
+    path = _history_path(user)
+    seen = {entry_hash(e) for e in iter_history_file(path)}
+    added = 0
+
+    def fresh():
+        nonlocal added
+        for e in incoming:
+            h = entry_hash(e)
+            if h not in seen:
+                seen.add(h)
+                added += 1
+                yield e
+
+    new = fresh()
+    first = next(new, None)
+    if first is None:
+        return 0
+
+    os.makedirs(utils_auth.HISTORY_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f"{user}.", suffix=".import.tmp", dir=utils_auth.HISTORY_DIR)
+    os.close(fd)
+    try:
+        _write_array(tmp, heapq.merge(iter_history_file(path), itertools.chain([first], new), key=_newest_first))
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return added
+
+def import_history(src: Union[str, IO[bytes]], email: Optional[str] = None) -> Dict[str, int]:
+    """Import an NDJSON export (plain or gzip). Idempotent: entries already stored are skipped.
+
+    With `email`, every entry goes to that user regardless of the `user` field.
+    Malformed lines are skipped and logged with their line number.
+    Returns {"read": entries read, "imported": entries added, "skipped": bad lines}.
+    """
+    target = _safe_email(email) if email else None
+    stats = {"read": 0, "imported": 0, "skipped": 0}
+    inp, owned = _open_in(src)
+
+    def records():
+        # Each record is keyed by (user, run): a run is a stretch of newest-first entries,
+        # which is what the streaming merge needs. A single-user export is one run; an
+        # all-users export imported with `email` has one per source user.
+        run, prev = 0, None
+        for n, line in enumerate(inp, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+                user = target or rec.get("user")
+                entry = rec.get("entry")
+                ok = isinstance(user, str) and user and isinstance(entry, dict) \
+                    and all(c in "0123456789abcdef" for c in user)
+            except (ValueError, AttributeError):
+                ok = False
+            if not ok:
+                stats["skipped"] += 1
+                log.warning("Skipping malformed record on line %d", n)
+                continue
+            stats["read"] += 1
+            if prev is not None and (prev[0] != user or _newest_first(entry) < _newest_first(prev[1])):
+                run += 1
+            prev = (user, entry)
+            yield (user, run), entry
+
+    try:
+        for (user, _), group in itertools.groupby(records(), key=lambda r: r[0]):
+            with history_lock(user):
+                stats["imported"] += _merge_user(user, (entry for _, entry in group))
+    finally:
+        if owned:
+            inp.close()
+        elif isinstance(inp, io.TextIOWrapper) and inp is not sys.stdin:
+            inp.detach()
+    return stats
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m codexr.history_io", description="Export/import CodeXR history as NDJSON.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ex = sub.add_parser("export", help="stream history to NDJSON")
+    ex.add_argument("--email", help="only this user (default: all users)")
+    ex.add_argument("-o", "--output", default="-", help="output path; .gz compresses; - for stdout")
+    im = sub.add_parser("import", help="merge an NDJSON export into data/history")
+    im.add_argument("input", help="NDJSON or .ndjson.gz path; - for stdin")
+    im.add_argument("--email", help="import every entry into this user")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "export":
+        n = export_history(args.output, args.email)
+        print(f"Exported {n} entries", file=sys.stderr)
+    else:
+        stats = import_history(args.input, args.email)
+        print(f"Read {stats['read']} entries, imported {stats['imported']} new, skipped {stats['skipped']} malformed",
+              file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,25 @@
-import os, json, asyncio
-from typing import Dict, Any, List
+import os, json, time, asyncio, hashlib, threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
 import google.generativeai as genai
-import requests
+import httpx
 from dotenv import load_dotenv
 
 from codexr.schema import Answer, Subtask, DocRef  # local imports
+from codexr.retrieval import load_index
+from codexr.fetch import fetch_pages, trim_extracts
+from codexr.tokens import estimate_tokens, trim_to_tokens
+from codexr.engine import Engine, Stage, RunResult
+from codexr.utils_auth import save_history
+from codexr.conversation import is_follow_up, last_query
+from codexr.profiling import profile_request, new_request_id
+from codexr.usage import record_usage
 
 # Always load .env before configuring Gemini
 load_dotenv()
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 SERPER_KEY = os.getenv("SERPER_API_KEY")
+GEMINI_MODEL = "gemini-1.5-flash"
 
 _VERBOSITY = {
     "concise": "Provide a very short, bullet-point summary with minimal explanation. Omit detailed explanations for code snippets.",
@@ -22,6 +32,17 @@ _VERBOSITY = {
 
 SCHEMA_EXAMPLE = Answer.model_json_schema()
 
+# Local BM25 grounding (see codexr.retrieval); bounded so it never crowds out the answer.
+LOCAL_TOP_K = 4
+LOCAL_CONTEXT_TOKENS = 1200
+# Live Mode page extracts (see codexr.fetch); the fetch stage has its own latency budget.
+WEB_CONTEXT_TOKENS = 1500
+# In-process cache of validated Gemini answers, checked concurrently with classification/search.
+ANSWER_CACHE_TTL = 60 * 60
+ANSWER_CACHE_SIZE = 128
+
+_XR_TERMS = ["ar","vr","xr","unity","unreal","openxr","oculus","hololens","mixed reality","shader","meta quest","pico","steamvr"]
+
 def classify_context(query: str) -> str:
     """Classify query into Unity / Unreal / Shader / General based on keywords."""
     q = query.lower()
@@ -33,17 +54,35 @@ def classify_context(query: str) -> str:
         return "Shader"
     return "General"
 
+def _local_grounding(query: str, top_k: int = LOCAL_TOP_K, max_tokens: int = LOCAL_CONTEXT_TOKENS) -> str:
+    """Top passages from the local docs index as a prompt section; "" if no index is built."""
+    index = load_index()
+    if index is None:
+        return ""
+    lines, budget = [], max_tokens
+    for p in index.top_passages(query, k=top_k):
+        line = f"- [{p['source']} — {p['title']}] {p['text']}"
+        if estimate_tokens(line) > budget:
+            if budget < 40:
+                break
+            line = trim_to_tokens(line, budget)
+        lines.append(line)
+        budget -= estimate_tokens(line)
+    if not lines:
+        return ""
+    return "\n\nGrounding Information from Local Documentation:\n" + "\n".join(lines)
+
 async def _search_web(query: str, num_results: int = 5) -> List[Dict[str, str]]:
     """Best-effort web search using Serper if key is available; otherwise return []."""
     if not SERPER_KEY:
         return []
     try:
-        resp = requests.post(
-            "https://google.serper.dev/search",
-            headers={"X-API-KEY": SERPER_KEY, "Content-Type": "application/json"},
-            json={"q": query, "num": num_results},
-            timeout=10,
-        )
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            resp = await client.post(
+                "https://google.serper.dev/search",
+                headers={"X-API-KEY": SERPER_KEY, "Content-Type": "application/json"},
+                json={"q": query, "num": num_results},
+            )
         data = resp.json()
         out = []
         for item in data.get("organic", [])[:num_results]:
@@ -55,64 +94,20 @@ async def _search_web(query: str, num_results: int = 5) -> List[Dict[str, str]]:
     except Exception:
         return []
 
-def generate_structured_answer(
-    query: str,
-    target: str = "AR/VR Developer",
-    verbosity: str = "normal",
-    max_output_tokens: int = 2000,
-    live_mode: bool = False,
-) -> Dict[str, Any]:
-    return asyncio.run(_generate_structured_answer_async(query, target, verbosity, max_output_tokens, live_mode))
+def _notice(context: str, target: str, title: str, details: str) -> Dict[str, Any]:
+    return Answer(
+        context=context,
+        target=target,
+        difficulty="beginner",
+        subtasks=[Subtask(title=title, details=details, steps=[])]
+    ).model_dump()
 
-async def _generate_structured_answer_async(
-    query: str,
-    target: str = "AR/VR Developer",
-    verbosity: str = "normal",
-    max_output_tokens: int = 2000,
-    live_mode: bool = False,
-) -> Dict[str, Any]:
+def build_prompt(query: str, verbosity: str = "normal", conversation: str = "", local_text: str = "", doc_text: str = "") -> str:
+    convo_text = ""
+    if conversation:
+        convo_text = "\n\nConversation so far (the query may be a follow-up to it):\n" + conversation
 
-    q = (query or "").lower().strip()
-
-    # Explicit context classification
-    context = classify_context(query)
-    target = f"{context} Developer"
-
-    # Quick intents (always include all required fields)
-    if q in ["hi", "hello", "hey"]:
-        return Answer(
-            context=context,
-            target=target,
-            difficulty="beginner",
-            subtasks=[Subtask(title="Greeting", details="👋 Hi, how can I help with AR/VR today?", steps=[])]
-        ).model_dump()
-
-    if q in ["bye", "goodbye", "see you"]:
-        return Answer(
-            context=context,
-            target=target,
-            difficulty="beginner",
-            subtasks=[Subtask(title="Farewell", details="👋 Goodbye, happy coding in XR!", steps=[])]
-        ).model_dump()
-
-    # Reject off-topic queries
-    if not any(x in q for x in ["ar","vr","xr","unity","unreal","openxr","oculus","hololens","mixed reality","shader","meta quest","pico","steamvr"]):
-        return Answer(
-            context=context,
-            target=target,
-            difficulty="beginner",
-            subtasks=[Subtask(title="Not Supported", details="❌ Sorry, I can only assist with AR/VR development topics like Unity XR, Unreal Engine, OpenXR, Mixed Reality, and shaders.", steps=[])]
-        ).model_dump()
-
-    docs: List[DocRef] = []
-    doc_text = ""
-    if live_mode:
-        results = await _search_web(query, num_results=5)
-        docs = [DocRef(title=r["title"], url=r["url"]) for r in results]
-        if docs:
-            doc_text = "\n\nGrounding Information from Web Search:\n" + "\n".join([f"- Title: {d.title}\n  URL: {d.url}" for d in docs])
-
-    prompt = f"""
+    return f"""
 You are CodeXR, an expert AR/VR coding assistant. Your goal is to provide comprehensive, structured answers to developer queries related to AR/VR development.
 Your responses MUST be valid JSON, strictly adhering to the following Pydantic schema:
 {json.dumps(SCHEMA_EXAMPLE, indent=2)}
@@ -121,17 +116,98 @@ Ensure ALL fields from the schema are included, even if empty (e.g., [] for list
 The `context`, `target`, and `difficulty` fields should be inferred from the query and context.
 Provide detailed steps, and if a code snippet is required, include language, filename, code, and explanation.
 Always include best_practices and gotchas relevant to the query, even if short.
+If local documentation passages are provided, prefer them over prior knowledge when they are relevant.
 If web search results are provided, integrate information from them into your answer, especially for docs.
-
+If earlier conversation turns are provided, treat the query as a follow-up and answer it in that context.
+{convo_text}
 User Query: {query}
 Verbosity Level: {_VERBOSITY.get(verbosity, _VERBOSITY['normal'])}
-{doc_text}
+{local_text}{doc_text}
 
 Remember: Output ONLY the JSON. No conversational text outside the JSON.
 """
 
+# ----------------- Answer cache -----------------
+_ANSWER_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_ANSWER_CACHE_LOCK = threading.Lock()    # lookups run on the event loop, stores on the deferred thread
+
+def _cache_key(query: str, verbosity: str, live_mode: bool, conversation: str, max_output_tokens: int) -> str:
+    raw = json.dumps([" ".join((query or "").lower().split()), verbosity, live_mode, conversation, max_output_tokens])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+# ----------------- Stages -----------------
+# Each stage takes its declared inputs as kwargs and returns a dict of its outputs.
+
+def _stage_classify(query):
+    context = classify_context(query)
+    return {"context": context, "target": f"{context} Developer"}
+
+def _stage_gate(query, context, target, conversation):
+    q = (query or "").lower().strip()
+    # Quick intents (always include all required fields)
+    if q in ["hi", "hello", "hey"]:
+        return {"answer": _notice(context, target, "Greeting", "👋 Hi, how can I help with AR/VR today?"), "outcome": "greeting"}
+    if q in ["bye", "goodbye", "see you"]:
+        return {"answer": _notice(context, target, "Farewell", "👋 Goodbye, happy coding in XR!"), "outcome": "farewell"}
+    # Reject off-topic queries; a follow-up to an on-topic turn inherits its topic.
+    on_topic = any(x in q for x in _XR_TERMS) or (
+        is_follow_up(q) and any(x in last_query(conversation).lower() for x in _XR_TERMS))
+    if not on_topic:
+        return {"answer": _notice(context, target, "Not Supported",
+                                  "❌ Sorry, I can only assist with AR/VR development topics like Unity XR, Unreal Engine, OpenXR, Mixed Reality, and shaders."),
+                "outcome": "off_topic"}
+    return {"on_topic": True}
+
+def _stage_cache_lookup(query, verbosity, live_mode, conversation, max_output_tokens):
+    key = _cache_key(query, verbosity, live_mode, conversation, max_output_tokens)
+    with _ANSWER_CACHE_LOCK:
+        hit = _ANSWER_CACHE.get(key)
+        if hit and time.time() - hit[0] < ANSWER_CACHE_TTL:
+            _ANSWER_CACHE.move_to_end(key)
+        else:
+            hit = None
+    if hit:
+        return {"cache_key": key, "cache_hit": True, "answer": json.loads(hit[1]), "outcome": "cache"}
+    return {"cache_key": key, "cache_hit": False}
+
+def _stage_local(query):
+    return {"local_text": _local_grounding(query)}
+
+async def _stage_search(query, live_mode):
+    if not live_mode:
+        return {"docs": []}
+    results = await _search_web(query, num_results=5)
+    return {"docs": [DocRef(title=r["title"], url=r["url"]) for r in results]}
+
+async def _stage_fetch(docs):
+    if not docs:
+        return {"doc_text": ""}
+    pages = await fetch_pages([d.url for d in docs])
+    extracts = {r["url"]: r["text"] for r in trim_extracts(
+        [{"url": d.url, "text": pages.get(d.url, "")} for d in docs], WEB_CONTEXT_TOKENS)}
+    lines = []
+    for d in docs:
+        line = f"- Title: {d.title}\n  URL: {d.url}"
+        if extracts.get(d.url):
+            line += f"\n  Extract: {extracts[d.url]}"
+        lines.append(line)
+    return {"doc_text": "\n\nGrounding Information from Web Search:\n" + "\n".join(lines)}
+
+def _stage_prompt(query, verbosity, conversation, local_text, doc_text, on_topic):
+    return {"prompt": build_prompt(query, verbosity, conversation, local_text, doc_text)}
+
+def gemini_usage(resp) -> Dict[str, int]:
+    """Prompt/output token counts reported by Gemini (zeros if the response has none)."""
+    meta = getattr(resp, "usage_metadata", None)
+    return {
+        "prompt_tokens": getattr(meta, "prompt_token_count", 0) or 0,
+        "output_tokens": getattr(meta, "candidates_token_count", 0) or 0,
+    }
+
+def _stage_generate(prompt, context, target, max_output_tokens):
+    usage = {"prompt_tokens": estimate_tokens(prompt), "output_tokens": 0}
     try:
-        model = genai.GenerativeModel("gemini-1.5-flash")
+        model = genai.GenerativeModel(GEMINI_MODEL)
         resp = model.generate_content(
             prompt,
             generation_config={
@@ -140,32 +216,135 @@ Remember: Output ONLY the JSON. No conversational text outside the JSON.
                 "response_mime_type": "application/json"
             },
         )
+        usage = gemini_usage(resp) if getattr(resp, "usage_metadata", None) else usage
         parsed = json.loads(resp.text)
 
         # ✅ Validate with schema — fall back gracefully if invalid
         try:
             validated = Answer.model_validate(parsed)
-            return validated.model_dump()
+            return {"answer": validated.model_dump(), "cacheable": True, "usage": usage, "outcome": "ok"}
         except Exception as ve:
-            return Answer(
-                context=context,
-                target=target,
-                difficulty="beginner",
-                subtasks=[Subtask(title="Validation Error", details=f"Response validation failed: {ve}", steps=[])]
-            ).model_dump()
+            return {"answer": _notice(context, target, "Validation Error", f"Response validation failed: {ve}"),
+                    "usage": usage, "outcome": "validation_error"}
 
     except json.JSONDecodeError as je:
-        return Answer(
-            context=context,
-            target=target,
-            difficulty="beginner",
-            subtasks=[Subtask(title="JSON Parse Error", details=f"Failed to parse LLM response as JSON: {je}", steps=[])]
-        ).model_dump()
+        return {"answer": _notice(context, target, "JSON Parse Error", f"Failed to parse LLM response as JSON: {je}"),
+                "usage": usage, "outcome": "json_error"}
 
     except Exception as e:
-        return Answer(
-            context=context,
-            target=target,
-            difficulty="beginner",
-            subtasks=[Subtask(title="Gemini Error", details=f"Error calling Gemini API: {e}", steps=[])]
-        ).model_dump()
+        return {"answer": _notice(context, target, "Gemini Error", f"Error calling Gemini API: {e}"),
+                "usage": usage, "outcome": "gemini_error"}
+
+def _stage_cache_store(cache_key, answer, cacheable):
+    if not cacheable or not cache_key:
+        return
+    entry = (time.time(), json.dumps(answer))
+    with _ANSWER_CACHE_LOCK:
+        _ANSWER_CACHE[cache_key] = entry
+        _ANSWER_CACHE.move_to_end(cache_key)
+        while len(_ANSWER_CACHE) > ANSWER_CACHE_SIZE:
+            _ANSWER_CACHE.popitem(last=False)
+
+def _stage_persist(user_email, query, answer, session_id, timestamp):
+    if not user_email:
+        return
+    entry = {"query": query, "answer": answer, "timestamp": timestamp}
+    if session_id:
+        entry["session_id"] = session_id
+    save_history(user_email, entry)
+
+def _stage_ledger(user_email, route, request_id, verbosity, live_mode, outcome, cache_hit, usage, timings, elapsed_ms):
+    usage = usage or {}
+    record_usage(
+        user_email, route or "generate",
+        model=GEMINI_MODEL if usage else "",
+        verbosity=verbosity, live_mode=live_mode,
+        prompt_tokens=usage.get("prompt_tokens", 0), output_tokens=usage.get("output_tokens", 0),
+        latency_ms=elapsed_ms, cache_hit=cache_hit, outcome=outcome or "ok",
+        stage_ms=timings, request_id=request_id or "",
+    )
+
+ANSWER_STAGES = [
+    Stage("classify", _stage_classify, ("query",), ("context", "target")),
+    Stage("gate", _stage_gate, ("query", "context", "target", "conversation"), ("answer", "on_topic", "outcome")),
+    Stage("cache_lookup", _stage_cache_lookup, ("query", "verbosity", "live_mode", "conversation", "max_output_tokens"),
+          ("cache_key", "cache_hit", "answer", "outcome"), fallback={"cache_hit": False}),
+    Stage("local_grounding", _stage_local, ("query",), ("local_text",), threaded=True, fallback={"local_text": ""}),
+    Stage("search", _stage_search, ("query", "live_mode"), ("docs",), fallback={"docs": []}),
+    Stage("fetch", _stage_fetch, ("docs",), ("doc_text",), fallback={"doc_text": ""}),
+    Stage("prompt", _stage_prompt, ("query", "verbosity", "conversation", "local_text", "doc_text", "on_topic"), ("prompt",)),
+    Stage("generate", _stage_generate, ("prompt", "context", "target", "max_output_tokens"), ("answer", "cacheable", "usage", "outcome"), threaded=True),
+    Stage("cache_store", _stage_cache_store, ("cache_key", "answer", "cacheable"), deferred=True),
+    Stage("persist", _stage_persist, ("user_email", "query", "answer", "session_id", "timestamp"), deferred=True),
+    Stage("ledger", _stage_ledger, ("user_email", "route", "request_id", "verbosity", "live_mode", "outcome",
+                                    "cache_hit", "usage", "timings", "elapsed_ms"), deferred=True),
+]
+
+ANSWER_ENGINE = Engine(ANSWER_STAGES)
+
+async def run_answer(
+    query: str,
+    verbosity: str = "normal",
+    max_output_tokens: int = 2000,
+    live_mode: bool = False,
+    conversation: str = "",
+    user_email: Optional[str] = None,
+    session_id: Optional[str] = None,
+    timestamp: Optional[int] = None,
+    engine: Optional[Engine] = None,
+    route: str = "generate",
+    request_id: Optional[str] = None,
+) -> RunResult:
+    """Run the answer pipeline; `values["answer"]` holds the Answer dict, `timings` the per-stage ms."""
+    return await (engine or ANSWER_ENGINE).run(
+        query=query or "",
+        verbosity=verbosity,
+        max_output_tokens=max_output_tokens,
+        live_mode=live_mode,
+        conversation=conversation,
+        user_email=user_email,
+        session_id=session_id,
+        timestamp=timestamp if timestamp is not None else int(time.time()),
+        route=route,
+        request_id=request_id or new_request_id(),
+    )
+
+def generate_structured_answer(
+    query: str,
+    target: str = "AR/VR Developer",
+    verbosity: str = "normal",
+    max_output_tokens: int = 2000,
+    live_mode: bool = False,
+    conversation: str = "",
+    user_email: Optional[str] = None,
+    session_id: Optional[str] = None,
+    timestamp: Optional[int] = None,
+    request_id: Optional[str] = None,
+    profile: Optional[bool] = None,
+) -> Dict[str, Any]:
+    """Pass `user_email` to have the entry saved to history after the answer is returned.
+
+    `profile` forces per-request profiling on/off; None defers to codexr.profiling.should_profile().
+    """
+    request_id = request_id or new_request_id()
+    with profile_request(request_id, enabled=profile):
+        return asyncio.run(_generate_structured_answer_async(
+            query, target, verbosity, max_output_tokens, live_mode, conversation, user_email, session_id, timestamp,
+            request_id))
+
+async def _generate_structured_answer_async(
+    query: str,
+    target: str = "AR/VR Developer",
+    verbosity: str = "normal",
+    max_output_tokens: int = 2000,
+    live_mode: bool = False,
+    conversation: str = "",
+    user_email: Optional[str] = None,
+    session_id: Optional[str] = None,
+    timestamp: Optional[int] = None,
+    request_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    # `target` is kept for compatibility; it is always inferred by the classify stage.
+    result = await run_answer(query, verbosity, max_output_tokens, live_mode, conversation,
+                              user_email, session_id, timestamp, request_id=request_id)
+    return result.values["answer"]
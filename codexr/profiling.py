@@ -0,0 +1,245 @@
+"""On-demand profiling of a single request.
+
+Profiling is switched on per request by any of:
+  - CODEXR_PROFILE=1 in the environment,
+  - an ``X-CodeXR-Profile: 1`` request header,
+  - CODEXR_PROFILE_SAMPLE_RATE (0..1) for random sampling.
+
+A profiled request runs under cProfile and tracemalloc and leaves three files
+in CODEXR_PROFILE_DIR tagged with its request id: ``.collapsed`` (folded stacks
+for flamegraph.pl / speedscope), ``.pstats`` and ``.alloc.txt`` (allocation
+growth since the request started, both at the sampled memory peak and at the
+end). When disabled, the only cost is the env/header check.
+"""
+import os, time, uuid, random, pstats, cProfile, threading, tracemalloc, contextvars, functools
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+PROFILE_DIR = os.getenv("CODEXR_PROFILE_DIR", os.path.join("data", "profiles"))
+PROFILE_HEADER = "X-CodeXR-Profile"
+TOP_ALLOCATIONS = 25
+PEAK_SAMPLE_INTERVAL = 0.02     # seconds between checks for a new memory peak
+_TRACE_FRAMES = 16
+_MAX_DEPTH = 64
+
+_TRUTHY = {"1", "true", "yes", "on"}
+
+class ProfileSession:
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.profiles: List[cProfile.Profile] = []
+        self.paths: Dict[str, str] = {}
+        self.peak_bytes = 0
+        self.start_snapshot: Optional[tracemalloc.Snapshot] = None
+
+class _PeakSampler(threading.Thread):
+    """Snapshots traced memory whenever it reaches a new high, so allocations
+    freed before the request ends still show up in the report."""
+
+    def __init__(self):
+        super().__init__(name="codexr-profile-peak", daemon=True)
+        self.stopped = threading.Event()
+        self.best = 0
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+
+    def run(self):
+        while not self.stopped.wait(PEAK_SAMPLE_INTERVAL):
+            try:
+                current = tracemalloc.get_traced_memory()[0]
+                if current > self.best:
+                    self.best, self.snapshot = current, tracemalloc.take_snapshot()
+            except RuntimeError:
+                return  # tracing was stopped under us
+
+# tracemalloc is process-wide: overlapping profiled requests share one tracing
+# session, started by the first and stopped when the last one finishes.
+_TRACING_LOCK = threading.Lock()
+_tracing_users = 0
+_tracing_owned = False
+
+def _acquire_tracing():
+    global _tracing_users, _tracing_owned
+    with _TRACING_LOCK:
+        if _tracing_users == 0:
+            _tracing_owned = not tracemalloc.is_tracing()
+            if _tracing_owned:
+                tracemalloc.start(_TRACE_FRAMES)
+        _tracing_users += 1
+
+def _release_tracing():
+    global _tracing_users
+    with _TRACING_LOCK:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_owned:
+            tracemalloc.stop()
+
+_ACTIVE: contextvars.ContextVar[Optional[ProfileSession]] = contextvars.ContextVar("codexr_profile", default=None)
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:12]
+
+def should_profile(headers: Optional[Mapping[str, str]] = None) -> bool:
+    """Whether this request should be profiled (env switch, header, or sampling)."""
+    if os.getenv("CODEXR_PROFILE", "").lower() in _TRUTHY:
+        return True
+    if headers:
+        value = headers.get(PROFILE_HEADER) or headers.get(PROFILE_HEADER.lower()) or ""
+        if value.lower() in _TRUTHY:
+            return True
+    rate = os.getenv("CODEXR_PROFILE_SAMPLE_RATE")
+    if rate:
+        try:
+            return random.random() < float(rate)
+        except ValueError:
+            return False
+    return False
+
+def in_profiled_thread(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap `fn` so that, inside a profiled request, it is also profiled on its worker thread.
+
+    cProfile only sees the thread that enabled it; asyncio.to_thread copies
+    context vars, so the active session is visible to the worker.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        session = _ACTIVE.get()
+        if session is None:
+            return fn(*args, **kwargs)
+        prof = cProfile.Profile()
+        session.profiles.append(prof)
+        prof.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            prof.disable()
+    return wrapper
+
+@contextmanager
+def profile_request(request_id: Optional[str] = None, enabled: Optional[bool] = None,
+                    headers: Optional[Mapping[str, str]] = None):
+    """Profile the enclosed block if enabled; yields the ProfileSession (or None when off)."""
+    if enabled is None:
+        enabled = should_profile(headers)
+    if not enabled or _ACTIVE.get() is not None:
+        yield None
+        return
+
+    session = ProfileSession(request_id or new_request_id())
+    token = _ACTIVE.set(session)
+    _acquire_tracing()
+    sampler = _PeakSampler()
+    try:
+        session.start_snapshot = tracemalloc.take_snapshot()
+        sampler.start()
+    except Exception:
+        pass
+    prof = cProfile.Profile()
+    session.profiles.append(prof)
+    prof.enable()
+    try:
+        yield session
+    finally:
+        prof.disable()
+        _ACTIVE.reset(token)
+        try:
+            try:
+                sampler.stopped.set()
+                if sampler.is_alive():
+                    sampler.join()
+                # Peak is process-wide, so it includes any request profiled at the same time.
+                snapshot = tracemalloc.take_snapshot()
+                session.peak_bytes = tracemalloc.get_traced_memory()[1]
+            finally:
+                _release_tracing()
+            _write_reports(session, snapshot, sampler.snapshot)
+        except Exception:
+            pass  # profiling must never break the request
+
+# ----------------- Reports -----------------
+def _label(func) -> str:
+    filename, lineno, name = func
+    if filename == "~":
+        label = name  # builtins, e.g. <method 'join' of 'str' objects>
+    else:
+        label = f"{os.path.basename(filename)}:{lineno}({name})"
+    return label.replace(";", ",").replace(" ", "_")
+
+def collapsed_stacks(stats: pstats.Stats) -> List[str]:
+    """Fold cProfile's caller graph into 'a;b;c <microseconds>' lines.
+
+    cProfile records call edges, not full stacks, so each edge's time is
+    split proportionally down the tree (the approach used by flameprof).
+    """
+    raw = stats.stats  # func -> (cc, nc, tt, ct, callers)
+    children: Dict[Any, List[Any]] = {}
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, edge in callers.items():
+            children.setdefault(caller, []).append((func, edge[3]))
+    roots = [f for f, v in raw.items() if not v[4]]
+
+    folded: Dict[str, float] = {}
+
+    def walk(func, path, budget):
+        if budget < 1e-6:  # below output resolution; also keeps wide call graphs from exploding
+            return
+        cc, nc, tt, ct, _ = raw[func]
+        scale = (budget / ct) if ct else 0.0
+        frame = path + [_label(func)]
+        key = ";".join(frame)
+        folded[key] = folded.get(key, 0.0) + tt * scale
+        if len(frame) >= _MAX_DEPTH:
+            return
+        for child, edge_ct in children.get(func, []):
+            if _label(child) in frame:  # recursion: attribute to the current frame instead
+                folded[key] += edge_ct * scale
+                continue
+            walk(child, frame, edge_ct * scale)
+
+    for root in roots:
+        walk(root, [], raw[root][3])
+    return [f"{k} {int(v * 1e6)}" for k, v in sorted(folded.items()) if int(v * 1e6) > 0]
+
+def _write_reports(session: ProfileSession, snapshot: tracemalloc.Snapshot,
+                   peak: Optional[tracemalloc.Snapshot] = None):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{session.request_id}")
+
+    stats = pstats.Stats(session.profiles[0])
+    for prof in session.profiles[1:]:
+        try:
+            stats.add(prof)
+        except TypeError:
+            pass  # a worker profile that never ran has no stats
+    stats.dump_stats(base + ".pstats")
+    session.paths["pstats"] = base + ".pstats"
+
+    with open(base + ".collapsed", "w") as f:
+        f.write("\n".join(collapsed_stacks(stats)) + "\n")
+    session.paths["collapsed"] = base + ".collapsed"
+
+    with open(base + ".alloc.txt", "w") as f:
+        f.write(f"request {session.request_id} — peak traced memory {session.peak_bytes / 1024:.1f} KiB\n")
+        if peak is not None:
+            _write_growth(f, "at the sampled memory peak", peak, session.start_snapshot)
+        _write_growth(f, "still held at end of request", snapshot, session.start_snapshot)
+    session.paths["alloc"] = base + ".alloc.txt"
+
+def _filtered(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+    return snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+def _write_growth(f, label: str, snapshot: tracemalloc.Snapshot, start: Optional[tracemalloc.Snapshot]):
+    """Top allocation sites by growth since the request started (absolute sizes without a start)."""
+    if start is None:
+        stats = [(s.size, s.count, s.traceback) for s in _filtered(snapshot).statistics("lineno")]
+    else:
+        diff = _filtered(snapshot).compare_to(_filtered(start), "lineno")
+        stats = sorted(((d.size_diff, d.count_diff, d.traceback) for d in diff if d.size_diff > 0), reverse=True,
+                       key=lambda x: x[0])
+    f.write(f"\ntop {TOP_ALLOCATIONS} allocation sites by growth since request start, {label}:\n\n")
+    for i, (size, count, tb) in enumerate(stats[:TOP_ALLOCATIONS], 1):
+        f.write(f"#{i}: +{size / 1024:.1f} KiB in {count:+d} blocks\n")
+        for line in tb.format(limit=3, most_recent_first=True):
+            f.write(f"    {line}\n")
@@ -0,0 +1,159 @@
+"""Regenerate a single section of an existing Answer.
+
+A section is addressed by a path into the Answer model, e.g. ``snippet``,
+``subtasks[2]``, ``subtasks[2].steps`` or ``best_practices``. Only that
+section is requested from Gemini, validated against its schema type and
+patched back in, so output tokens scale with the section, not the answer.
+"""
+import re, json, time, typing
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import google.generativeai as genai
+from pydantic import BaseModel, TypeAdapter
+
+from codexr.llm import _VERBOSITY, GEMINI_MODEL, gemini_usage
+from codexr.usage import record_usage
+from codexr.utils_auth import update_history_entry
+from codexr.schema import Answer, DocRef, Snippet, Subtask
+from codexr.tokens import estimate_tokens
+
+_PART_RE = re.compile(r"([a-z_]+)((?:\[\d+\])*)")
+
+def parse_path(path: str) -> List[Union[str, int]]:
+    """`subtasks[2].steps` -> ["subtasks", 2, "steps"]."""
+    parts: List[Union[str, int]] = []
+    for seg in (path or "").strip().split("."):
+        m = _PART_RE.fullmatch(seg)
+        if not m:
+            raise ValueError(f"Invalid section path: {path!r}")
+        parts.append(m.group(1))
+        parts.extend(int(i) for i in re.findall(r"\d+", m.group(2)))
+    return parts
+
+def _unwrap_optional(tp):
+    if typing.get_origin(tp) is Union:
+        args = [a for a in typing.get_args(tp) if a is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return tp
+
+def resolve_section(answer: Dict[str, Any], path: str) -> Tuple[Any, Any]:
+    """Return (schema type, current value) for `path` inside an Answer dict."""
+    tp: Any = Answer
+    value: Any = answer
+    for part in parse_path(path):
+        tp = _unwrap_optional(tp)
+        if not isinstance(part, int) and not isinstance(value, dict):
+            raise ValueError(f"{path!r}: the parent section is empty; refine it as a whole first")
+        if isinstance(part, int):
+            if typing.get_origin(tp) not in (list, List):
+                raise ValueError(f"{path!r}: cannot index into a non-list section")
+            tp = typing.get_args(tp)[0]
+            if not isinstance(value, list) or not -len(value) <= part < len(value):
+                raise ValueError(f"{path!r}: index {part} out of range")
+            value = value[part]
+        else:
+            if not (isinstance(tp, type) and issubclass(tp, BaseModel)) or part not in tp.model_fields:
+                raise ValueError(f"{path!r}: unknown section {part!r}")
+            tp = tp.model_fields[part].annotation
+            value = value.get(part) if isinstance(value, dict) else None
+    return _unwrap_optional(tp), value
+
+def patch_section(answer: Dict[str, Any], path: str, new_value: Any) -> Dict[str, Any]:
+    """Return a validated copy of `answer` with `path` replaced by `new_value`."""
+    parts = parse_path(path)
+    patched = json.loads(json.dumps(answer))
+    node = patched
+    for part in parts[:-1]:
+        node = node[part]
+    node[parts[-1]] = new_value
+    return Answer.model_validate(patched).model_dump()
+
+def section_options(answer: Dict[str, Any]) -> Dict[str, str]:
+    """Human label -> path for the sections of `answer` that can be refined."""
+    opts = {}
+    for i, s in enumerate(answer.get("subtasks") or []):
+        opts[f"Subtask {i+1}: {s.get('title', '')}"] = f"subtasks[{i}]"
+    opts["Code snippet"] = "snippet"
+    opts["Best practices"] = "best_practices"
+    opts["Gotchas"] = "gotchas"
+    # No "Docs": without retrieval in the refine prompt the model would just invent URLs.
+    return opts
+
+# Minimum output tokens by section type, so an empty or tiny section can still be filled in.
+# Lists get their item's floor per item (at least _MIN_ITEMS of them).
+_BUDGET_FLOOR = {Snippet: 1024, Subtask: 512, DocRef: 64, str: 64}
+_MIN_ITEMS = 3
+
+def _budget_floor(tp: Any, current: Any) -> int:
+    if typing.get_origin(tp) in (list, List):
+        item = _BUDGET_FLOOR.get(typing.get_args(tp)[0], 64)
+        return max(256, item * max(_MIN_ITEMS, len(current or [])))
+    return max(256, _BUDGET_FLOOR.get(tp, 256))
+
+def _output_budget(tp: Any, current: Any, cap: int) -> int:
+    # Leave room for the section to grow (e.g. "more detail"), never the whole answer's budget.
+    return min(cap, max(_budget_floor(tp, current), 3 * estimate_tokens(json.dumps(current)) + 256))
+
+def refine_answer_section(
+    answer: Dict[str, Any],
+    path: str,
+    instruction: str = "",
+    query: str = "",
+    verbosity: str = "normal",
+    max_output_tokens: int = 2000,
+    user_email: Optional[str] = None,
+    timestamp: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Regenerate only `path` of `answer` and return the patched Answer dict.
+
+    With `user_email` and `timestamp`, the stored history entry (matched by
+    timestamp and `query`) is updated too. Raises ValueError if the path is
+    invalid or Gemini's section fails validation.
+    """
+    answer = Answer.model_validate(answer).model_dump()
+    tp, current = resolve_section(answer, path)
+    adapter = TypeAdapter(tp)
+
+    prompt = f"""
+You are CodeXR, an expert AR/VR coding assistant. You are improving ONE section of an existing structured answer.
+Return ONLY the replacement value for the section `{path}` as valid JSON matching this schema:
+{json.dumps(adapter.json_schema(), indent=2)}
+
+Original User Query: {query or "(not provided)"}
+Verbosity Level: {_VERBOSITY.get(verbosity, _VERBOSITY['normal'])}
+Requested change: {instruction or "Make this section more accurate, complete and useful."}
+
+Full answer for context (do not repeat other sections):
+{json.dumps(answer, separators=(",", ":"))}
+
+Current value of `{path}`:
+{json.dumps(current, indent=2)}
+
+Remember: Output ONLY the JSON for `{path}`. No conversational text outside the JSON.
+"""
+    t0 = time.perf_counter()
+    model = genai.GenerativeModel(GEMINI_MODEL)
+    resp = model.generate_content(
+        prompt,
+        generation_config={
+            "max_output_tokens": _output_budget(tp, current, max_output_tokens),
+            "temperature": 0.2,
+            "response_mime_type": "application/json",
+        },
+    )
+    gen_ms = (time.perf_counter() - t0) * 1000
+    try:
+        new_value = adapter.validate_python(json.loads(resp.text))
+        outcome = "ok"
+    except Exception as e:
+        outcome = "validation_error"
+        raise ValueError(f"Refined section failed validation: {e}") from e
+    finally:
+        record_usage(user_email, "refine", model=GEMINI_MODEL, verbosity=verbosity,
+                     latency_ms=gen_ms, outcome=outcome, stage_ms={"generate": round(gen_ms, 2)},
+                     **gemini_usage(resp))
+    patched = patch_section(answer, path, adapter.dump_python(new_value, mode="json"))
+    if user_email and timestamp is not None:
+        update_history_entry(user_email, timestamp, query, patched)
+    return patched
@@ -0,0 +1,261 @@
+"""Local BM25 retrieval over an ingested directory of XR documentation.
+
+Build once with ``python -m codexr.retrieval build <docs_dir> [index_dir]``;
+the index is written as flat files so postings can be memory-mapped on load
+and queried per request without any network call.
+
+Each build goes into a fresh ``v-<ns timestamp>`` directory under index_dir and
+is published by atomically replacing the ``CURRENT`` pointer file, so a
+running app never sees a half-written index and never has files it has
+memory-mapped rewritten underneath it.
+"""
+import os, re, json, math, mmap, time, heapq, shutil, argparse, threading
+from array import array
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from codexr.textutil import html_to_text
+
+INDEX_DIR = os.getenv("CODEXR_INDEX_DIR", os.path.join("data", "index"))
+DOC_EXTENSIONS = (".md", ".markdown", ".txt", ".html", ".htm")
+
+KEEP_VERSIONS = 2           # older builds are removed once a newer one is published
+
+CHUNK_WORDS = 180
+CHUNK_OVERLAP = 40
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+[#+]*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from how i in is it of on or that the this to was what when with you your".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in _STOPWORDS]
+
+# ----------------- Ingestion -----------------
+def _sections(text: str, default_title: str) -> Iterator[Tuple[str, str]]:
+    """Split Markdown-ish text on headings, yielding (heading, body)."""
+    title, buf = default_title, []
+    for line in text.splitlines():
+        m = re.match(r"^\s*#{1,6}\s+(.*\S)", line)
+        if m:
+            if any(l.strip() for l in buf):
+                yield title, "\n".join(buf)
+            title, buf = m.group(1).strip(), []
+        else:
+            buf.append(line)
+    if any(l.strip() for l in buf):
+        yield title, "\n".join(buf)
+
+def chunk_text(text: str, default_title: str) -> Iterator[Tuple[str, str]]:
+    """Yield (title, passage) windows of ~CHUNK_WORDS words with overlap."""
+    step = CHUNK_WORDS - CHUNK_OVERLAP
+    for title, body in _sections(text, default_title):
+        words = body.split()
+        for start in range(0, len(words), step):
+            yield title, " ".join(words[start:start + CHUNK_WORDS])
+            if start + CHUNK_WORDS >= len(words):
+                break
+
+def iter_documents(docs_dir: str) -> Iterator[Tuple[str, str]]:
+    """Yield (relative path, plain text) for every supported file under docs_dir."""
+    for root, _, files in os.walk(docs_dir):
+        for name in sorted(files):
+            if not name.lower().endswith(DOC_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            try:
+                with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                    raw = f.read()
+            except OSError:
+                continue
+            text = html_to_text(raw) if name.lower().endswith((".html", ".htm")) else raw
+            yield os.path.relpath(path, docs_dir), text
+
+# ----------------- Index build -----------------
+def build_index(docs_dir: str, index_dir: str = INDEX_DIR) -> int:
+    """Chunk every document under docs_dir and publish a new BM25 index version. Returns the chunk count."""
+    os.makedirs(index_dir, exist_ok=True)
+    version = f"v-{time.time_ns()}"
+    build_dir = os.path.join(index_dir, version + ".building")
+    os.makedirs(build_dir)
+    try:
+        n = _write_index(docs_dir, build_dir)
+        os.rename(build_dir, os.path.join(index_dir, version))
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    pointer_tmp = os.path.join(index_dir, f"CURRENT.{os.getpid()}.tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(version)
+    os.replace(pointer_tmp, os.path.join(index_dir, "CURRENT"))
+    _prune_versions(index_dir, version)
+    return n
+
+def _prune_versions(index_dir: str, current: str):
+    # Unlinking a file another process still has mapped is safe on POSIX: the mapping keeps the inode.
+    versions = sorted(n for n in os.listdir(index_dir) if n.startswith("v-") and not n.endswith(".building"))
+    for name in versions[:-KEEP_VERSIONS]:
+        if name != current:
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+
+def _write_index(docs_dir: str, index_dir: str) -> int:
+    postings: Dict[str, List[int]] = {}
+    doclens = array("I")
+    offsets = array("Q")
+
+    with open(os.path.join(index_dir, "chunks.jsonl"), "wb") as cf:
+        for source, text in iter_documents(docs_dir):
+            default_title = os.path.splitext(os.path.basename(source))[0]
+            for title, passage in chunk_text(text, default_title):
+                cid = len(doclens)
+                terms = tokenize(title + " " + passage)
+                for term, tf in Counter(terms).items():
+                    postings.setdefault(term, []).extend((cid, tf))
+                doclens.append(len(terms))
+                offsets.append(cf.tell())
+                cf.write(json.dumps({"source": source, "title": title, "text": passage}).encode() + b"\n")
+
+    lexicon: Dict[str, List[int]] = {}
+    with open(os.path.join(index_dir, "postings.bin"), "wb") as pf:
+        pos = 0
+        for term in sorted(postings):
+            flat = array("I", postings[term])
+            flat.tofile(pf)
+            lexicon[term] = [pos, len(flat) // 2]
+            pos += len(flat)
+
+    with open(os.path.join(index_dir, "doclens.bin"), "wb") as f:
+        doclens.tofile(f)
+    with open(os.path.join(index_dir, "offsets.bin"), "wb") as f:
+        offsets.tofile(f)
+    with open(os.path.join(index_dir, "lexicon.json"), "w") as f:
+        json.dump(lexicon, f, separators=(",", ":"))
+    with open(os.path.join(index_dir, "meta.json"), "w") as f:
+        json.dump({"version": 1, "n_chunks": len(doclens),
+                   "avgdl": (sum(doclens) / len(doclens)) if doclens else 0.0}, f)
+    return len(doclens)
+
+# ----------------- Query -----------------
+def _map(path: str) -> Optional[mmap.mmap]:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class BM25Index:
+    """Read-only view over one published index version (see `current_version`)."""
+
+    def __init__(self, index_dir: str, k1: float = 1.2, b: float = 0.75):
+        self.index_dir = index_dir
+        self.k1, self.b = k1, b
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            meta = json.load(f)
+        with open(os.path.join(index_dir, "lexicon.json")) as f:
+            self.lexicon: Dict[str, List[int]] = json.load(f)
+        self.n_chunks = meta["n_chunks"]
+        self.avgdl = meta["avgdl"] or 1.0
+        self._maps = [_map(os.path.join(index_dir, n)) for n in ("postings.bin", "doclens.bin", "offsets.bin")]
+        pm, dm, om = self._maps
+        self._postings = memoryview(pm).cast("I") if pm else memoryview(b"").cast("I")
+        self._doclens = memoryview(dm).cast("I") if dm else memoryview(b"").cast("I")
+        self._offsets = memoryview(om).cast("Q") if om else memoryview(b"").cast("Q")
+        # chunks.jsonl is mapped too: slicing is thread-safe, a shared seek()+readline() handle is not.
+        self._chunks = _map(os.path.join(index_dir, "chunks.jsonl"))
+
+    def close(self):
+        for v in (self._postings, self._doclens, self._offsets):
+            v.release()
+        for m in self._maps + [self._chunks]:
+            if m is not None:
+                m.close()
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Return the top-k (chunk id, score) pairs for `query`."""
+        n, k1, b, avgdl = self.n_chunks, self.k1, self.b, self.avgdl
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            entry = self.lexicon.get(term)
+            if not entry:
+                continue
+            start, df = entry
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            plist = self._postings[start:start + 2 * df]
+            for i in range(0, 2 * df, 2):
+                cid, tf = plist[i], plist[i + 1]
+                norm = k1 * (1.0 - b + b * self._doclens[cid] / avgdl)
+                scores[cid] = scores.get(cid, 0.0) + idf * tf * (k1 + 1.0) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+
+    def chunk(self, cid: int) -> Dict[str, str]:
+        start = self._offsets[cid]
+        end = self._offsets[cid + 1] if cid + 1 < len(self._offsets) else len(self._chunks)
+        return json.loads(self._chunks[start:end])
+
+    def top_passages(self, query: str, k: int = 5) -> List[Dict[str, str]]:
+        out = []
+        for cid, score in self.search(query, k):
+            c = self.chunk(cid)
+            c["score"] = round(score, 3)
+            out.append(c)
+        return out
+
+_INDEX_CACHE: Dict[str, Tuple[str, BM25Index]] = {}
+_INDEX_LOCK = threading.Lock()
+
+def current_version(index_dir: str = INDEX_DIR) -> Optional[str]:
+    """Directory of the published index version, or None if nothing has been built yet."""
+    try:
+        with open(os.path.join(index_dir, "CURRENT")) as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    return os.path.join(index_dir, version) if version else None
+
+def load_index(index_dir: str = INDEX_DIR) -> Optional[BM25Index]:
+    """The index at index_dir, reopened whenever a new version is published; None if none is built.
+
+    Replaced versions are dropped rather than closed: requests still using
+    them keep working and the mappings go away with the last reference.
+    """
+    path = current_version(index_dir)
+    if path is None:
+        return None
+    cached = _INDEX_CACHE.get(index_dir)
+    if cached and cached[0] == path:
+        return cached[1]
+    with _INDEX_LOCK:
+        cached = _INDEX_CACHE.get(index_dir)
+        if cached and cached[0] == path:
+            return cached[1]
+        try:
+            index = BM25Index(path)
+        except (OSError, ValueError, KeyError):
+            return cached[1] if cached else None
+        _INDEX_CACHE[index_dir] = (path, index)
+        return index
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m codexr.retrieval", description="Local BM25 index for CodeXR grounding.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="ingest a docs directory and write the index")
+    b.add_argument("docs_dir")
+    b.add_argument("index_dir", nargs="?", default=INDEX_DIR)
+    s = sub.add_parser("search", help="query an existing index")
+    s.add_argument("query")
+    s.add_argument("-k", type=int, default=5)
+    s.add_argument("--index-dir", default=INDEX_DIR)
+    args = ap.parse_args(argv)
+
+    if args.cmd == "build":
+        n = build_index(args.docs_dir, args.index_dir)
+        print(f"Indexed {n} chunks into {args.index_dir}")
+    else:
+        idx = load_index(args.index_dir)
+        if idx is None:
+            ap.error(f"no index at {args.index_dir}; run `build` first")
+        for p in idx.top_passages(args.query, args.k):
+            print(f"[{p['score']}] {p['source']} — {p['title']}\n    {p['text'][:160]}")
+
+if __name__ == "__main__":
+    main()
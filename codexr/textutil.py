@@ -0,0 +1,68 @@
+"""HTML -> plain text, shared by document ingestion and Live Mode page fetching."""
+import re
+from html.parser import HTMLParser
+from typing import List, Optional
+
+class HTMLText(HTMLParser):
+    """HTML -> text that can be fed incrementally; with `max_chars` it reports when it has enough.
+
+    Headings h1-h4 become Markdown ``#`` markers so the text can still be split
+    into sections. `compact` collapses whitespace (prompt text); otherwise it is
+    kept as-is so code in <pre> survives (indexed docs).
+    """
+    _SKIP = {"script", "style", "noscript", "nav", "header", "footer", "svg", "form"}
+    _BLOCK = {"p", "div", "li", "pre", "br", "tr", "section", "article", "h1", "h2", "h3", "h4", "h5", "h6"}
+
+    def __init__(self, max_chars: Optional[int] = None, compact: bool = False):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.compact = compact
+        self.parts: List[str] = []
+        self.size = 0
+        self._skip = 0
+
+    @property
+    def done(self) -> bool:
+        return self.max_chars is not None and self.size >= self.max_chars
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP:
+            self._skip += 1
+        elif tag in ("h1", "h2", "h3", "h4") and not self._skip:
+            self.parts.append("\n" + "#" * int(tag[1]) + " ")
+        elif tag in self._BLOCK:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP and self._skip:
+            self._skip -= 1
+        elif tag in self._BLOCK:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        if self.compact:
+            data = " ".join(data.split())
+            data = data and data + " "
+        self.add_text(data)
+
+    def add_text(self, data: str):
+        """Append already-plain text (e.g. a text/plain response) under the same cap."""
+        if data and not self.done:
+            self.parts.append(data)
+            self.size += len(data)
+
+    def text(self) -> str:
+        out = "".join(self.parts)
+        if self.compact:
+            out = "\n".join(l.strip() for l in out.splitlines() if l.strip())
+        else:
+            out = re.sub(r"\n\s*\n+", "\n\n", out).strip()
+        return out[:self.max_chars] if self.max_chars is not None else out
+
+def html_to_text(html: str, max_chars: Optional[int] = None) -> str:
+    p = HTMLText(max_chars)
+    p.feed(html)
+    p.close()
+    return p.text()
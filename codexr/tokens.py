@@ -0,0 +1,24 @@
+import re
+
+# Gemini tokenizes English/code at roughly 4 characters per token; close enough
+# for budgeting prompt sections without a network round-trip to count_tokens.
+_CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """Cheap, local approximation of the number of tokens in `text`."""
+    if not text:
+        return 0
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` to roughly `max_tokens`, preferring a whitespace boundary."""
+    if max_tokens <= 0 or not text:
+        return ""
+    limit = max_tokens * _CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    m = re.search(r"\s+\S*$", cut)
+    if m and m.start() > limit // 2:
+        cut = cut[:m.start()]
+    return cut.rstrip() + " …"
@@ -0,0 +1,158 @@
+"""Append-only usage ledger: tokens, latency and outcome per request.
+
+Rows are appended to one CSV file per UTC day (``data/usage/usage-YYYY-MM-DD.csv``)
+with a fixed, flat column set, so a date range only touches its own
+partitions and the files load directly into pandas/DuckDB/Parquet.
+
+    python -m codexr.usage report --by user,day --since 2026-10-01
+"""
+import os, csv, json, time, argparse, threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from codexr.utils_auth import DATA_DIR, _safe_email
+
+USAGE_DIR = os.path.join(DATA_DIR, "usage")
+
+COLUMNS = [
+    "ts", "day", "request_id", "user", "route", "model", "verbosity", "live_mode",
+    "prompt_tokens", "output_tokens", "latency_ms", "cache_hit", "outcome", "stage_ms",
+]
+GROUP_KEYS = ("user", "day", "route", "model", "verbosity", "live_mode", "outcome", "cache_hit")
+
+_LOCK = threading.Lock()
+
+def user_key(email: Optional[str]) -> str:
+    return _safe_email(email)[:16] if email else "anonymous"
+
+def _partition(day: str) -> str:
+    return os.path.join(USAGE_DIR, f"usage-{day}.csv")
+
+def record_usage(
+    user_email: Optional[str],
+    route: str,
+    model: str = "",
+    verbosity: str = "",
+    live_mode: bool = False,
+    prompt_tokens: int = 0,
+    output_tokens: int = 0,
+    latency_ms: float = 0.0,
+    cache_hit: bool = False,
+    outcome: str = "ok",
+    stage_ms: Optional[Dict[str, float]] = None,
+    request_id: str = "",
+):
+    """Append one request to today's partition. Never raises; the ledger must not break a request."""
+    now = time.time()
+    day = datetime.fromtimestamp(now, timezone.utc).strftime("%Y-%m-%d")
+    row = [
+        int(now), day, request_id, user_key(user_email), route, model, verbosity, int(bool(live_mode)),
+        int(prompt_tokens or 0), int(output_tokens or 0), round(latency_ms or 0.0, 2), int(bool(cache_hit)),
+        outcome, json.dumps(stage_ms or {}, separators=(",", ":")),
+    ]
+    try:
+        with _LOCK:
+            os.makedirs(USAGE_DIR, exist_ok=True)
+            path = _partition(day)
+            new = not os.path.exists(path)
+            with open(path, "a", newline="") as f:
+                w = csv.writer(f)
+                if new:
+                    w.writerow(COLUMNS)
+                w.writerow(row)
+    except Exception:
+        pass
+
+# ----------------- Queries -----------------
+def _partition_days(since: Optional[str], until: Optional[str]) -> List[str]:
+    if since:
+        start = date.fromisoformat(since)
+        end = date.fromisoformat(until) if until else datetime.now(timezone.utc).date()
+        return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+    days = sorted(n[len("usage-"):-len(".csv")] for n in os.listdir(USAGE_DIR)
+                  if n.startswith("usage-") and n.endswith(".csv"))
+    return [d for d in days if not until or d <= until]
+
+def iter_rows(since: Optional[str] = None, until: Optional[str] = None) -> Iterator[Dict[str, str]]:
+    """Stream ledger rows in day order, touching only partitions within [since, until]."""
+    if not os.path.isdir(USAGE_DIR):
+        return
+    for day in _partition_days(since, until):
+        path = _partition(day)
+        if not os.path.exists(path):
+            continue
+        with open(path, newline="") as f:
+            yield from csv.DictReader(f)
+
+def _percentile(sorted_vals: Sequence[float], p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    i = min(len(sorted_vals) - 1, max(0, int(round(p / 100 * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+def aggregate(
+    by: Iterable[str] = ("user", "day"),
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    rows: Optional[Iterable[Dict[str, str]]] = None,
+) -> List[Dict[str, Any]]:
+    """Group ledger rows by `by` columns; tokens are summed, latency gets p50/p95/max.
+
+    Sorted by total tokens, heaviest first.
+    """
+    by = tuple(by)
+    bad = [k for k in by if k not in GROUP_KEYS]
+    if bad:
+        raise ValueError(f"Cannot group by {bad}; choose from {GROUP_KEYS}")
+
+    groups: Dict[tuple, Dict[str, Any]] = {}
+    for r in rows if rows is not None else iter_rows(since, until):
+        key = tuple(r[k] for k in by)
+        g = groups.get(key)
+        if g is None:
+            g = groups[key] = {"requests": 0, "prompt_tokens": 0, "output_tokens": 0, "cache_hits": 0, "_lat": []}
+        g["requests"] += 1
+        g["prompt_tokens"] += int(r["prompt_tokens"] or 0)
+        g["output_tokens"] += int(r["output_tokens"] or 0)
+        g["cache_hits"] += int(r["cache_hit"] or 0)
+        g["_lat"].append(float(r["latency_ms"] or 0.0))
+
+    out = []
+    for key, g in groups.items():
+        lat = sorted(g.pop("_lat"))
+        out.append({
+            **dict(zip(by, key)), **g,
+            "total_tokens": g["prompt_tokens"] + g["output_tokens"],
+            "p50_ms": _percentile(lat, 50), "p95_ms": _percentile(lat, 95), "max_ms": lat[-1] if lat else 0.0,
+        })
+    out.sort(key=lambda x: (x["total_tokens"], x["p95_ms"]), reverse=True)
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m codexr.usage", description="CodeXR token/latency usage report.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rp = sub.add_parser("report", help="aggregate the ledger")
+    rp.add_argument("--by", default="user,day", help=f"comma-separated group columns from {', '.join(GROUP_KEYS)}")
+    rp.add_argument("--since", help="YYYY-MM-DD (inclusive)")
+    rp.add_argument("--until", help="YYYY-MM-DD (inclusive)")
+    rp.add_argument("--top", type=int, default=20, help="rows to show (0 for just the header)")
+    rp.add_argument("--sort", default="total_tokens",
+                    choices=["total_tokens", "prompt_tokens", "output_tokens", "requests", "p50_ms", "p95_ms", "max_ms"])
+    args = ap.parse_args(argv)
+
+    if args.top < 0:
+        ap.error("--top must be >= 0")
+    by = [k.strip() for k in args.by.split(",") if k.strip()]
+    try:
+        rows = aggregate(by, args.since, args.until)
+    except ValueError as e:
+        ap.error(str(e))
+    rows.sort(key=lambda x: x[args.sort], reverse=True)
+    cols = by + ["requests", "prompt_tokens", "output_tokens", "cache_hits", "p50_ms", "p95_ms", "max_ms"]
+    widths = [max([len(c)] + [len(str(r[c])) for r in rows[:args.top]]) for c in cols]
+    print("  ".join(c.ljust(w) for c, w in zip(cols, widths)))
+    for r in rows[:args.top]:
+        print("  ".join(str(r[c]).ljust(w) for c, w in zip(cols, widths)))
+
+if __name__ == "__main__":
+    main()
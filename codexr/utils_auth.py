@@ -1,4 +1,10 @@
-import os, json, time, hashlib
+import os, json, time, shutil, hashlib, threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: the in-process lock still serializes the app's own writes
+    fcntl = None
 
 DATA_DIR = "data"
 USERS_FILE = os.path.join(DATA_DIR, "users.json")
@@ -6,6 +12,12 @@ HISTORY_DIR = os.path.join(DATA_DIR, "history")
 
 os.makedirs(HISTORY_DIR, exist_ok=True)
 
+# History files are read-modify-written from background threads and by the
+# history_io CLI in another process, so writes are serialized per user both
+# in-process and with an flock on <hash>.lock.
+_HISTORY_LOCKS = {}
+_HISTORY_LOCKS_GUARD = threading.Lock()
+
 def _safe_email(email: str) -> str:
     return hashlib.sha256(email.strip().lower().encode()).hexdigest()
 
@@ -45,20 +57,31 @@ def login_user(email: str, password: str):
         return False, "Incorrect password"
     return True, users[email]
 
+@contextmanager
+def history_lock(email_hash: str):
+    with _HISTORY_LOCKS_GUARD:
+        lock = _HISTORY_LOCKS.setdefault(email_hash, threading.Lock())
+    with lock:
+        os.makedirs(HISTORY_DIR, exist_ok=True)
+        with open(os.path.join(HISTORY_DIR, f"{email_hash}.lock"), "a") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+            yield
+
+def _write_history(path: str, hist: list):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(hist, f, indent=2, default=_json_default)
+    os.replace(tmp, path)
+
 def save_history(email: str, entry: dict):
     e = _safe_email(email)
     path = os.path.join(HISTORY_DIR, f"{e}.json")
-    hist = []
-    if os.path.exists(path):
-        try:
-            with open(path, "r") as f:
-                hist = json.load(f)
-        except Exception:
-            hist = []
-    entry["timestamp"] = int(time.time())
-    hist.insert(0, entry)
-    with open(path, "w") as f:
-        json.dump(hist, f, indent=2, default=_json_default)
+    entry.setdefault("timestamp", int(time.time()))
+    with history_lock(e):
+        hist = load_history(email)
+        hist.insert(0, entry)
+        _write_history(path, hist)
 
 def load_history(email: str):
     e = _safe_email(email)
@@ -71,12 +94,28 @@ def load_history(email: str):
     except Exception:
         return []
 
+def update_history_entry(email: str, timestamp: int, query: str, answer: dict) -> bool:
+    """Replace the answer of the entry saved at `timestamp` for `query`; False if not found."""
+    e = _safe_email(email)
+    path = os.path.join(HISTORY_DIR, f"{e}.json")
+    with history_lock(e):
+        hist = load_history(email)
+        for h in hist:
+            if h.get("timestamp") == timestamp and h.get("query") == query:
+                h["answer"] = answer
+                _write_history(path, hist)
+                return True
+    return False
+
 def clear_history(email: str):
     e = _safe_email(email)
     path = os.path.join(HISTORY_DIR, f"{e}.json")
     try:
-        if os.path.exists(path):
-            os.remove(path)
+        with history_lock(e):
+            if os.path.exists(path):
+                os.remove(path)
+        # Rolling conversation summaries (codexr.conversation) are derived from the history.
+        shutil.rmtree(os.path.join(DATA_DIR, "sessions", e), ignore_errors=True)
         return True
     except Exception:
         return False
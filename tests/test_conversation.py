@@ -0,0 +1,66 @@
+import os, tempfile, unittest
+from unittest import mock
+
+from codexr import conversation, utils_auth
+from codexr.llm import _notice, _stage_gate
+from codexr.tokens import estimate_tokens
+
+EMAIL = "a@b.c"
+
+def _turn(i, sid="s1"):
+    return {
+        "query": f"unity vr question {i} " + "detail " * 200,
+        "answer": {"subtasks": [{"title": f"Step {i}", "details": "words " * 300, "steps": ["do it"] * 20}],
+                   "snippet": {"filename": f"F{i}.cs", "language": "csharp", "code": "x();\n" * 300}},
+        "timestamp": 1000 + i,
+        "session_id": sid,
+    }
+
+class BuildContextTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        os.makedirs(utils_auth.HISTORY_DIR)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_bounded_for_any_length(self):
+        history = []
+        for i in range(60):
+            history.insert(0, _turn(i))
+            ctx = conversation.build_context(EMAIL, "s1", history)
+            self.assertLessEqual(estimate_tokens(ctx), conversation.CONTEXT_TOKENS)
+        self.assertIn("Earlier in this conversation", ctx)
+        self.assertIn("question 59", ctx)
+
+    def test_summary_cache_is_extended_not_rebuilt(self):
+        history = [_turn(i) for i in reversed(range(10))]
+        conversation.build_context(EMAIL, "s1", history)
+        history.insert(0, _turn(10))
+        with mock.patch.object(conversation, "compress_turn", wraps=conversation.compress_turn) as compress:
+            conversation.build_context(EMAIL, "s1", history)
+        self.assertEqual(compress.call_count, 1)  # only the newly aged-out turn
+
+    def test_other_sessions_and_notices_are_ignored(self):
+        notice = {"query": "what is the weather", "answer": _notice("General", "General", "Not Supported", "no"),
+                  "timestamp": 1, "session_id": "s1"}
+        history = [_turn(1, sid="s2"), notice]
+        self.assertEqual(conversation.build_context(EMAIL, "s1", history), "")
+
+class TopicGateTest(unittest.TestCase):
+    def gate(self, query, conversation_text=""):
+        return _stage_gate(query, "General", "General Developer", conversation_text).get("outcome")
+
+    def test_gate(self):
+        convo = "Most recent turns:\nUser: how do I teleport in unity vr\nCodeXR:\n- Teleport: ..."
+        self.assertIsNone(self.gate("unity vr teleport"))
+        self.assertEqual(self.gate("write a cover letter for a bank job"), "off_topic")
+        self.assertIsNone(self.gate("now make it work for Quest 3", convo))
+        self.assertEqual(self.gate("what's the capital of France", convo), "off_topic")
+        self.assertEqual(self.gate("now make it work for Quest 3"), "off_topic")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import os, asyncio, tempfile, threading, unittest
+
+from codexr import llm
+from codexr.engine import Engine, Stage
+
+ANSWER = {"context": "Unity", "target": "Unity Developer", "difficulty": "beginner",
+          "subtasks": [{"title": "Teleport", "details": "Add a teleport provider.", "steps": []}]}
+
+class EngineTest(unittest.TestCase):
+    def test_result_short_circuits_and_cancels(self):
+        slow_finished = []
+
+        async def slow():
+            await asyncio.sleep(1)
+            slow_finished.append(True)
+            return {"answer": "slow"}
+
+        engine = Engine([
+            Stage("fast", lambda: {"answer": "fast"}, (), ("answer",)),
+            Stage("slow", slow, (), ("answer",)),
+        ])
+        result = asyncio.run(engine.run())
+        self.assertEqual(result.values["answer"], "fast")
+        self.assertEqual(slow_finished, [])
+
+    def test_shared_output_takes_first_non_none(self):
+        async def late():
+            await asyncio.sleep(0.05)
+            return {"outcome": "late"}
+
+        engine = Engine([
+            Stage("none", lambda: {}, (), ("outcome",)),
+            Stage("late", late, (), ("outcome",)),
+            Stage("use", lambda outcome: {"answer": outcome}, ("outcome",), ("answer",)),
+        ])
+        self.assertEqual(asyncio.run(engine.run()).values["answer"], "late")
+
+    def test_failing_stage_surfaces_its_error(self):
+        def boom(x):
+            raise KeyError("boom")
+
+        engine = Engine([Stage("boom", boom, ("x",), ("y",)), Stage("use", lambda y: {"answer": y}, ("y",), ("answer",))])
+        with self.assertRaises(KeyError):
+            asyncio.run(engine.run(x=1))
+
+    def test_optional_stage_uses_fallback(self):
+        def boom(x):
+            raise ValueError("corrupt index")
+
+        engine = Engine([
+            Stage("ground", boom, ("x",), ("text",), threaded=True, fallback={"text": ""}),
+            Stage("use", lambda text: {"answer": f"[{text}]"}, ("text",), ("answer",)),
+        ])
+        with self.assertLogs("codexr.engine", "WARNING"):
+            self.assertEqual(asyncio.run(engine.run(x=1)).values["answer"], "[]")
+
+    def test_missing_input_is_rejected_up_front(self):
+        with self.assertRaises(ValueError):
+            asyncio.run(Engine([Stage("use", lambda y: {"answer": y}, ("y",), ("answer",))]).run())
+
+class AnswerPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        llm._ANSWER_CACHE.clear()
+        self.calls = []
+        self.persisted = []
+        self.ledger = []
+        self.release = threading.Event()
+
+        def search(query, live_mode):
+            self.calls.append("search")
+            return {"docs": []}
+
+        def generate(prompt, context, target, max_output_tokens):
+            self.calls.append("generate")
+            return {"answer": ANSWER, "cacheable": True, "usage": {}, "outcome": "ok"}
+
+        def persist(user_email, query, answer, session_id, timestamp):
+            self.release.wait(5)
+            self.persisted.append((query, answer))
+
+        def ledger(**kwargs):
+            self.ledger.append(kwargs)
+
+        self.engine = (llm.ANSWER_ENGINE.replace("search", fn=search).replace("generate", fn=generate)
+                       .replace("persist", fn=persist).replace("ledger", fn=ledger))
+
+    def tearDown(self):
+        self.release.set()
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def run_answer(self, query, **kw):
+        result = asyncio.run(llm.run_answer(query, user_email="a@b.c", engine=self.engine, **kw))
+        self.release.set()
+        for f in result.deferred:
+            f.result(timeout=5)
+        return result
+
+    def test_greeting_short_circuits(self):
+        result = self.run_answer("hi")
+        self.assertEqual(result.values["answer"]["subtasks"][0]["title"], "Greeting")
+        self.assertNotIn("generate", self.calls)
+        self.assertEqual(self.ledger[0]["outcome"], "greeting")
+
+    def test_cache_hit_skips_generate(self):
+        self.run_answer("unity vr teleport")
+        self.calls.clear()
+        self.release.clear()
+        result = self.run_answer("Unity VR   teleport")
+        self.assertEqual(result.values["answer"], ANSWER)
+        self.assertNotIn("generate", self.calls)
+        self.assertEqual(self.ledger[-1]["outcome"], "cache")
+
+    def test_deferred_stages_run_after_return(self):
+        result = asyncio.run(llm.run_answer("unity vr teleport", user_email="a@b.c", engine=self.engine))
+        self.assertEqual(self.persisted, [])  # persist is still blocked, yet the answer is back
+        self.release.set()
+        for f in result.deferred:
+            f.result(timeout=5)
+        self.assertEqual(self.persisted, [("unity vr teleport", ANSWER)])
+        self.assertEqual(self.ledger[0]["outcome"], "ok")
+        self.assertIn("generate", self.ledger[0]["timings"])
+
+    def test_broken_local_grounding_still_answers(self):
+        def broken(query):
+            raise ValueError("corrupt chunks.jsonl")
+
+        self.engine = self.engine.replace("local_grounding", fn=broken)
+        with self.assertLogs("codexr.engine", "WARNING"):
+            self.assertEqual(self.run_answer("unity vr teleport").values["answer"], ANSWER)
+
+if __name__ == "__main__":
+    unittest.main()
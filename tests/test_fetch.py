@@ -0,0 +1,80 @@
+import os, time, asyncio, tempfile, threading, unittest
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from codexr import fetch
+
+class _Handler(SimpleHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(2)
+        return super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+class FetchPagesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.TemporaryDirectory()
+        with open(os.path.join(cls.root.name, "big.txt"), "w") as f:
+            f.write("x" * 200_000)
+        with open(os.path.join(cls.root.name, "page.html"), "w") as f:
+            f.write("<html><body><nav>menu</nav><p>Hello XR</p><script>nope()</script></body></html>")
+        with open(os.path.join(cls.root.name, "slow"), "w") as f:
+            f.write("late")
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_Handler, directory=cls.root.name))
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.root.cleanup()
+
+    def setUp(self):
+        fetch._CACHE.clear()
+        self._ttl = fetch.CACHE_TTL
+
+    def tearDown(self):
+        fetch.CACHE_TTL = self._ttl
+
+    def fetch(self, urls, **kw):
+        kw.setdefault("allow_private", True)
+        return asyncio.run(fetch.fetch_pages(urls, **kw))
+
+    def test_extracts_text(self):
+        url = f"{self.base}/page.html"
+        self.assertEqual(self.fetch([url])[url].strip(), "Hello XR")
+
+    def test_byte_cap(self):
+        url = f"{self.base}/big.txt"
+        out = self.fetch([url], max_bytes=1000, max_chars=10**6)
+        self.assertEqual(len(out[url]), 1000)
+
+    def test_budget_cutoff(self):
+        fast, slow = f"{self.base}/page.html", f"{self.base}/slow"
+        t0 = time.perf_counter()
+        out = self.fetch([fast, slow], budget=0.5)
+        self.assertLess(time.perf_counter() - t0, 1.5)
+        self.assertIn(fast, out)
+        self.assertNotIn(slow, out)
+
+    def test_revalidates_with_304(self):
+        fetch.CACHE_TTL = 0
+        url = f"{self.base}/page.html"
+        self.fetch([url])
+        entry = fetch._CACHE[url]
+        self.assertTrue(entry.last_modified)
+        entry.text = "from cache"
+        self.assertEqual(self.fetch([url])[url], "from cache")
+
+    def test_rejects_non_public_hosts(self):
+        url = f"{self.base}/page.html"
+        self.assertEqual(self.fetch([url], allow_private=False), {})
+        self.assertFalse(asyncio.run(fetch.is_public_url("http://169.254.169.254/latest/meta-data/")))
+        self.assertFalse(asyncio.run(fetch.is_public_url("file:///etc/passwd")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import os, sys, json, time, tempfile, subprocess, unittest
+
+from codexr import history_io, utils_auth
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _entry(i, user="a"):
+    return {"query": f"{user} unity question {i}", "answer": {"subtasks": []}, "timestamp": 1000 + i}
+
+class HistoryIoTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        os.makedirs(utils_auth.HISTORY_DIR)
+        for i in range(5):
+            utils_auth.save_history("a@x.y", _entry(i))
+        for i in range(3):
+            utils_auth.save_history("b@x.y", _entry(10 + i, "b"))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def timestamps(self, email):
+        return [e["timestamp"] for e in utils_auth.load_history(email)]
+
+    def write_lines(self, name, lines):
+        with open(name, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return name
+
+    def test_round_trip(self):
+        for name in ("backup.ndjson", "backup.ndjson.gz"):
+            before = {e: utils_auth.load_history(e) for e in ("a@x.y", "b@x.y")}
+            self.assertEqual(history_io.export_history(name), 8)
+            utils_auth.clear_history("a@x.y")
+            utils_auth.clear_history("b@x.y")
+            self.assertEqual(history_io.import_history(name), {"read": 8, "imported": 8, "skipped": 0})
+            self.assertEqual({e: utils_auth.load_history(e) for e in before}, before)
+
+    def test_reimport_adds_nothing_and_leaves_file_alone(self):
+        history_io.export_history("backup.ndjson")
+        path = history_io._history_path(utils_auth._safe_email("a@x.y"))
+        mtime = os.stat(path).st_mtime_ns
+        self.assertEqual(history_io.import_history("backup.ndjson")["imported"], 0)
+        self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+        self.assertEqual(len(utils_auth.load_history("a@x.y")), 5)
+        self.assertEqual([n for n in os.listdir(utils_auth.HISTORY_DIR) if n.endswith(".tmp")], [])
+
+    def test_restore_keeps_newest_first_with_newer_entries(self):
+        history_io.export_history("a.ndjson", email="a@x.y")
+        utils_auth.clear_history("a@x.y")
+        utils_auth.save_history("a@x.y", _entry(50))
+        self.assertEqual(history_io.import_history("a.ndjson")["imported"], 5)
+        self.assertEqual(self.timestamps("a@x.y"), [1050, 1004, 1003, 1002, 1001, 1000])
+
+    def test_all_users_export_into_one_email(self):
+        history_io.export_history("all.ndjson")
+        stats = history_io.import_history("all.ndjson", email="c@x.y")
+        self.assertEqual(stats["imported"], 8)
+        ts = self.timestamps("c@x.y")
+        self.assertEqual(ts, sorted(ts, reverse=True))
+
+    def test_out_of_order_input(self):
+        user = utils_auth._safe_email("d@x.y")
+        lines = [json.dumps({"user": user, "entry": _entry(i, "d")}) for i in (3, 7, 1, 9, 5)]
+        self.assertEqual(history_io.import_history(self.write_lines("d.ndjson", lines))["imported"], 5)
+        self.assertEqual(self.timestamps("d@x.y"), [1009, 1007, 1005, 1003, 1001])
+
+    def test_malformed_lines_are_skipped(self):
+        user = utils_auth._safe_email("e@x.y")
+        lines = [json.dumps({"user": user, "entry": _entry(1, "e")}), "{not json", '["list"]',
+                 json.dumps({"user": "../../etc", "entry": _entry(2, "e")}),
+                 json.dumps({"user": user, "entry": _entry(3, "e")})]
+        with self.assertLogs("codexr.history_io", "WARNING") as logs:
+            stats = history_io.import_history(self.write_lines("e.ndjson", lines))
+        self.assertEqual(stats, {"read": 2, "imported": 2, "skipped": 3})
+        self.assertIn("line 2", logs.output[0])
+        self.assertEqual(self.timestamps("e@x.y"), [1003, 1001])
+
+    @unittest.skipIf(utils_auth.fcntl is None, "needs fcntl")
+    def test_lock_is_held_across_processes(self):
+        holder = subprocess.Popen(
+            [sys.executable, "-c",
+             "import sys, time; from codexr import utils_auth as u\n"
+             "with u.history_lock(u._safe_email('a@x.y')):\n"
+             "    print('locked', flush=True); time.sleep(0.5)"],
+            cwd=self.tmp.name, env=dict(os.environ, PYTHONPATH=REPO), stdout=subprocess.PIPE, text=True)
+        try:
+            self.assertEqual(holder.stdout.readline().strip(), "locked")
+            t0 = time.perf_counter()
+            utils_auth.save_history("a@x.y", _entry(99))
+            self.assertGreater(time.perf_counter() - t0, 0.3)
+        finally:
+            holder.wait(5)
+            holder.stdout.close()
+        self.assertEqual(len(utils_auth.load_history("a@x.y")), 6)
+
+if __name__ == "__main__":
+    unittest.main()
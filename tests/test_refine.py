@@ -0,0 +1,81 @@
+import os, json, tempfile, unittest
+from typing import List
+from unittest import mock
+
+from codexr import refine, utils_auth
+from codexr.schema import Snippet, Subtask
+
+ANSWER = {
+    "context": "Unity", "target": "Unity Developer", "difficulty": "beginner",
+    "subtasks": [
+        {"title": "Install", "details": "Add the XR Interaction Toolkit.", "steps": ["Open Package Manager"]},
+        {"title": "Teleport", "details": "Add a teleport provider.", "steps": []},
+    ],
+    "snippet": None, "best_practices": ["Test on device"], "gotchas": [], "docs": [],
+}
+
+class PathTest(unittest.TestCase):
+    def test_parse_path(self):
+        self.assertEqual(refine.parse_path("subtasks[2].steps"), ["subtasks", 2, "steps"])
+        self.assertEqual(refine.parse_path("snippet"), ["snippet"])
+        for bad in ("", "subtasks[x]", "Subtasks", "snippet..code"):
+            with self.assertRaises(ValueError):
+                refine.parse_path(bad)
+
+    def test_resolve_section(self):
+        self.assertEqual(refine.resolve_section(ANSWER, "subtasks[1]"), (Subtask, ANSWER["subtasks"][1]))
+        self.assertEqual(refine.resolve_section(ANSWER, "subtasks[0].steps"), (List[str], ["Open Package Manager"]))
+        self.assertEqual(refine.resolve_section(ANSWER, "snippet"), (Snippet, None))
+
+    def test_resolve_section_errors(self):
+        for bad in ("subtasks[5]", "best_practices[0].title", "context[0]", "nope", "snippet.code"):
+            with self.assertRaises(ValueError, msg=bad):
+                refine.resolve_section(ANSWER, bad)
+
+    def test_patch_section(self):
+        patched = refine.patch_section(ANSWER, "subtasks[1].steps", ["Add TeleportationProvider"])
+        self.assertEqual(patched["subtasks"][1]["steps"], ["Add TeleportationProvider"])
+        self.assertEqual(ANSWER["subtasks"][1]["steps"], [])  # original untouched
+        with self.assertRaises(Exception):
+            refine.patch_section(ANSWER, "subtasks[1]", {"title": "missing details"})
+
+    def test_section_options(self):
+        opts = refine.section_options(ANSWER)
+        self.assertEqual(opts["Subtask 2: Teleport"], "subtasks[1]")
+        self.assertNotIn("docs", opts.values())
+
+    def test_output_budget_floors(self):
+        self.assertGreaterEqual(refine._output_budget(Snippet, None, 4000), 1024)
+        self.assertGreaterEqual(refine._output_budget(List[Subtask], ANSWER["subtasks"], 4000), 3 * 512)
+        self.assertEqual(refine._output_budget(List[Subtask], ANSWER["subtasks"], 800), 800)
+
+class RefineApiTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        os.makedirs(utils_auth.HISTORY_DIR)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def _model(self, value):
+        resp = mock.Mock(text=json.dumps(value), usage_metadata=None)
+        return mock.Mock(return_value=mock.Mock(generate_content=mock.Mock(return_value=resp)))
+
+    def test_updates_history_entry(self):
+        utils_auth.save_history("a@b.c", {"query": "unity teleport", "answer": ANSWER, "timestamp": 7})
+        with mock.patch.object(refine.genai, "GenerativeModel", self._model(["Check tracking origin"])):
+            out = refine.refine_answer_section(ANSWER, "gotchas", query="unity teleport",
+                                               user_email="a@b.c", timestamp=7)
+        self.assertEqual(out["gotchas"], ["Check tracking origin"])
+        self.assertEqual(utils_auth.load_history("a@b.c")[0]["answer"]["gotchas"], ["Check tracking origin"])
+
+    def test_invalid_section_raises(self):
+        with mock.patch.object(refine.genai, "GenerativeModel", self._model({"not": "a list"})):
+            with self.assertRaises(ValueError):
+                refine.refine_answer_section(ANSWER, "gotchas")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import io, os, csv, tempfile, unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from codexr import usage
+
+def _write_day(day, rows):
+    os.makedirs(usage.USAGE_DIR, exist_ok=True)
+    with open(usage._partition(day), "w", newline="") as f:
+        w = csv.DictWriter(f, usage.COLUMNS)
+        w.writeheader()
+        for r in rows:
+            w.writerow({c: r.get(c, "") for c in usage.COLUMNS})
+
+def _row(day, user="u1", route="generate", prompt=100, output=50, latency=10.0, cache_hit=0, outcome="ok"):
+    return {"ts": 0, "day": day, "user": user, "route": route, "prompt_tokens": prompt, "output_tokens": output,
+            "latency_ms": latency, "cache_hit": cache_hit, "outcome": outcome, "stage_ms": "{}"}
+
+class UsageTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        _write_day("2026-10-01", [_row("2026-10-01", latency=l) for l in (10, 20, 30, 40, 500)])
+        _write_day("2026-10-02", [_row("2026-10-02", user="u2", prompt=1000, cache_hit=1, outcome="cache")])
+        _write_day("2026-10-03", [_row("2026-10-03", route="refine")])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_record_usage_appends_to_todays_partition(self):
+        usage.record_usage("a@b.c", "generate", prompt_tokens=5, output_tokens=7, outcome="ok", stage_ms={"generate": 1.5})
+        usage.record_usage(None, "refine", outcome="validation_error")
+        rows = list(usage.iter_rows(since=usage.datetime.now(usage.timezone.utc).date().isoformat()))
+        self.assertEqual([r["route"] for r in rows], ["generate", "refine"])
+        self.assertEqual(rows[0]["user"], usage.user_key("a@b.c"))
+        self.assertEqual(rows[1]["user"], "anonymous")
+
+    def test_aggregate(self):
+        out = {r["user"]: r for r in usage.aggregate(by=["user"])}
+        self.assertEqual(out["u1"]["requests"], 6)
+        self.assertEqual(out["u1"]["p50_ms"], 20.0)
+        self.assertEqual(out["u1"]["max_ms"], 500.0)
+        self.assertEqual(out["u2"]["cache_hits"], 1)
+        self.assertEqual(usage.aggregate(by=["user"])[0]["user"], "u2")  # heaviest first
+        with self.assertRaises(ValueError):
+            usage.aggregate(by=["prompt_tokens"])
+
+    def test_only_partitions_in_range_are_read(self):
+        opened = []
+        real_open = open
+
+        def tracking_open(path, *a, **kw):
+            opened.append(os.path.basename(path))
+            return real_open(path, *a, **kw)
+
+        with mock.patch("builtins.open", tracking_open):
+            rows = list(usage.iter_rows(since="2026-10-02", until="2026-10-02"))
+        self.assertEqual({r["day"] for r in rows}, {"2026-10-02"})
+        self.assertEqual(opened, ["usage-2026-10-02.csv"])
+        self.assertEqual({r["day"] for r in usage.iter_rows(until="2026-10-02")}, {"2026-10-01", "2026-10-02"})
+
+    def test_report_cli(self):
+        for top in ("0", "1"):
+            buf = io.StringIO()
+            with redirect_stdout(buf):
+                usage.main(["report", "--by", "route,outcome", "--top", top])
+            lines = buf.getvalue().splitlines()
+            self.assertTrue(lines[0].startswith("route"))
+            self.assertEqual(len(lines), 1 + int(top))
+
+if __name__ == "__main__":
+    unittest.main()